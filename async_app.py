@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import time
+
+import aiomysql
+import pymysql
+from quart import Quart, Response, g, request, render_template_string
+
+import test5
+from test5 import (
+    BOROUGH_TEMP_SQL, DATE_RANGE_SQL, DATE_HOUR_SQL, HOURLY_SQL, HOUR_BOROUGH_SQL, TEMP_BUCKET_SQL, TIME_BUCKETS,
+    TOP_BY_TEMP_SQL, DATE_HOUR_HTML, DATE_RANGE_HTML, GRAPH_HTML, HOURLY_HTML, TEMP_RANGE_HTML, TOP_BY_TIME_HTML,
+)
+
+# ASGI serving mode for the test5.py routes: same URLs, SQL, cache and
+# templates, but queries go through an aiomysql pool, so a slow query
+# waits without holding a worker and one process serves many clients.
+# Independent queries within a request (/dashboardData) run concurrently.
+#
+#   hypercorn async_app:app --bind 127.0.0.1:8000
+#
+# config.yaml is read once by test5.init_pool (cache, temperature buckets,
+# memory backend); the pool: section sizes the aiomysql pool here.
+
+app = Quart(__name__)
+pool = None
+# One slot per pool connection. Queries wait here in arrival order:
+# aiomysql's own wait lets a newly arrived request take a freed connection
+# ahead of older waiters, which starved some queries under load.
+db_slots = None
+
+for rule, view in [
+    ('/', test5.home),
+    ('/hourlyInput', test5.hourly_input),
+    ('/dateRangeInput', test5.date_range_input),
+    ('/dateHourInput', test5.date_hour_input),
+    ('/tempComplaintVisualizer', test5.temp_complaint_visualizer),
+]:
+    # static forms; Quart runs sync views in a thread
+    app.add_url_rule(rule, view_func=view)
+
+
+async def create_pool(db_config, size=8, max_lifetime=3600, ping_after=30, timeout=10):
+    # Takes the same pool: settings as test5.ConnectionPool. aiomysql
+    # recycles connections older than max_lifetime on checkout; ping_after
+    # has no equivalent and is ignored.
+    return await aiomysql.create_pool(
+        host=db_config['host'],
+        port=db_config['port'],
+        user=db_config['user'],
+        password=db_config['passwd'],
+        db=db_config['db'],
+        autocommit=True,
+        cursorclass=aiomysql.DictCursor,
+        minsize=1,
+        maxsize=size,
+        pool_recycle=max_lifetime,
+        connect_timeout=timeout,
+    )
+
+
+@app.before_serving
+async def startup():
+    global pool, db_slots
+    test5.init_pool(app.config.get('CONFIG_FILE', test5.config_file))
+    if test5.memory is None:
+        # a memory backend only reads MySQL through test5's pool, and only
+        # when loaded from it
+        pool = await create_pool(test5.config['db'], **test5.config.get('pool', {}))
+        db_slots = asyncio.Semaphore(pool.maxsize)
+
+
+@app.after_serving
+async def shutdown():
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+def memory_query(name, args):
+    with test5._memory_lock:
+        return test5.memory.query(name, args)
+
+
+async def run_query(name, sql, params=(), args=None):
+    # test5.run_query for the event loop: (rows, seconds, cached), sharing
+    # test5's result cache and memory backend
+    if test5.version_check_due():
+        # rare and cheap; runs on test5's blocking pool in a thread
+        try:
+            await asyncio.to_thread(test5.check_data_version)
+        except pymysql.err.Error:
+            if test5.memory is None:
+                g.no_cache = True
+                raise
+    args = params if args is None else args
+    key = (name, args)
+    t0 = time.time()
+    rows = test5.cache.get(key)
+    cached = rows is not None
+    if not cached:
+        try:
+            if test5.memory is not None:
+                rows = await asyncio.to_thread(memory_query, name, args)
+            else:
+                async with db_slots, pool.acquire() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.execute(sql, params)
+                        rows = await cur.fetchall()
+        except Exception:
+            g.no_cache = True
+            raise
+        test5.cache.put(key, rows)
+    return [dict(row) for row in rows], time.time() - t0, cached
+
+
+@app.before_request
+async def conditional_get():
+    # test5.conditional_get: a 304 without running the endpoint's queries
+    if not test5.revalidates(request):
+        return None
+    if test5.version_check_due():
+        try:
+            await asyncio.to_thread(test5.check_data_version)
+        except pymysql.err.Error:
+            return None
+    g.validators = test5.http_validators()
+    if g.validators and test5.not_modified(request, g.validators):
+        return '', 304
+
+
+@app.after_request
+async def cache_headers(response):
+    if request.endpoint not in test5.cacheable_endpoints:
+        return response
+    if g.get('no_cache') or response.status_code not in (200, 304):
+        response.cache_control.no_store = True
+    elif g.get('validators'):
+        test5.set_cache_headers(response, g.validators)
+    return response
+
+
+@app.after_request
+async def compress(response):
+    # test5.compress
+    if response.mimetype not in test5.compressible_types or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code == 200:
+        encoded = test5.encode_body(await response.get_data(), request.accept_encodings)
+        if encoded:
+            response.headers['Content-Encoding'], body = encoded
+            response.set_data(body)
+    return response
+
+
+def uncached(body):
+    # test5.uncached on Quart's g
+    g.no_cache = True
+    return body
+
+
+def json_response(res):
+    if res.get('code') != 1:
+        g.no_cache = True
+    return Response(test5.json_body(res, request.args.get('format')), mimetype='application/json')
+
+
+def invalid_key(res):
+    res['code'] = 0
+    res['msg'] = 'Invalid key'
+    return json_response(res)
+
+
+async def json_query(req, name, sql):
+    # the JSON routes that run one query without parameters
+    res = {'req': req}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    try:
+        rows, sqltime, cached = await run_query(name, sql)
+        res.update({'code': 1, 'msg': 'ok', 'sqltime': round(sqltime, 4), 'cached': cached,
+                    'data': test5.label_buckets(rows)})
+    except Exception as e:
+        res.update({'code': 0, 'msg': f'Error: {str(e)}'})
+    return json_response(res)
+
+
+@app.route('/getHourlyComplaints')
+async def get_hourly_complaints():
+    return await json_query('getHourlyComplaints', 'hourly', HOURLY_SQL)
+
+
+@app.route('/complaintsByTempBucket')
+async def complaints_by_temp():
+    return await json_query('complaintsByTempBucket', 'temp_bucket', test5.temp_sql(TEMP_BUCKET_SQL))
+
+
+@app.route('/boroughComplaintsByTemp')
+async def borough_temp():
+    return await json_query('boroughComplaintsByTemp', 'borough_temp', test5.temp_sql(BOROUGH_TEMP_SQL))
+
+
+@app.route('/topComplaintTypesByTemp')
+async def top_complaints_by_temp():
+    res = {'req': 'topComplaintTypesByTemp'}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    try:
+        sql = test5.top_k_sql(test5.temp_sql(TOP_BY_TEMP_SQL), 'bucket', 'bucket, complaint_type, cnt')
+        rows, sqltime, cached = await run_query('top_by_temp', sql, (test5.top_k_arg(request.args, 20),))
+        res.update({'code': 1, 'msg': 'ok', 'sqltime': round(sqltime, 4), 'cached': cached,
+                    'data': test5.buckets.label_rows(rows)})
+    except Exception as e:
+        res.update({'code': 0, 'msg': f'Error: {str(e)}'})
+    return json_response(res)
+
+
+@app.route('/graph')
+async def graph():
+    data, _, _ = await run_query('hourly', HOURLY_SQL)
+    return await render_template_string(GRAPH_HTML, hours=list(range(24)), data=test5.hourly_series(data))
+
+
+@app.route('/hourlyData')
+async def hourly_data():
+    try:
+        hour = int(request.args.get('hour'))
+        if not (0 <= hour <= 23):
+            return uncached("Hour must be between 0 and 23")
+        rows, _, _ = await run_query('hour_borough', HOUR_BOROUGH_SQL, (hour,))
+        return await render_template_string(HOURLY_HTML, hour=hour, boroughs=[row['borough'] for row in rows],
+                                            counts=[row['cnt'] for row in rows])
+    except Exception as e:
+        return uncached(f" Error: {e}")
+
+
+@app.route('/dateRangeData')
+async def date_range_data():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    res = {'req': 'dateRangeData'}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    try:
+        rows, _, _ = await run_query('date_range', DATE_RANGE_SQL,
+                                     (test5.normalize_date(start), test5.normalize_date(end)))
+        return await render_template_string(DATE_RANGE_HTML, start=start, end=end,
+                                            boroughs=[row['borough'] for row in rows],
+                                            counts=[row['cnt'] for row in rows])
+    except Exception as e:
+        res['code'] = 0
+        res['msg'] = f'Error: {str(e)}'
+        return json_response(res)
+
+
+@app.route('/dateHourData')
+async def date_hour_data():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start_hr = request.args.get('start_hr', type=int)
+    end_hr = request.args.get('end_hr', type=int)
+    res = {'req': 'dateHourData'}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    try:
+        hour_condition, hours = test5.hour_window(start_hr, end_hr)
+        rows, _, _ = await run_query('date_hour', DATE_HOUR_SQL.format(hour_condition=hour_condition),
+                                     (test5.normalize_date(start), test5.normalize_date(end), start_hr, end_hr))
+        return await render_template_string(DATE_HOUR_HTML, start=start, end=end, start_hr=start_hr,
+                                            end_hr=end_hr, hours=hours, data=test5.hour_series(rows, hours))
+    except Exception as e:
+        res['code'] = 0
+        res['msg'] = f'Error: {str(e)}'
+        return json_response(res)
+
+
+@app.route('/topComplaintsByTime')
+async def top_complaints_by_time():
+    bucket = request.args.get('bucket', 'night').lower()
+    res = {'req': 'topComplaintsByTime'}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    if bucket not in TIME_BUCKETS:
+        res['code'] = 0
+        res['msg'] = f"Invalid time bucket. Choose from {list(TIME_BUCKETS.keys())}"
+        return json_response(res)
+    try:
+        k = test5.top_k_arg(request.args, 3)
+    except ValueError as e:
+        res['code'] = 0
+        res['msg'] = str(e)
+        return json_response(res)
+
+    start_hr, end_hr = TIME_BUCKETS[bucket]
+    rows, _, _ = await run_query('top_by_time', *test5.top_by_time_query(start_hr, end_hr, k))
+    labels, dataset = test5.top_chart(rows)
+    return await render_template_string(TOP_BY_TIME_HTML, bucket=bucket, start_hr=start_hr, end_hr=end_hr,
+                                        labels=labels, dataset=dataset)
+
+
+@app.route('/complaintsByTempRange')
+async def complaints_by_temp_range():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start_hr = int(request.args.get('start_hr'))
+    end_hr = int(request.args.get('end_hr'))
+    borough = request.args.get('borough')
+    res = {'req': 'complaintsByTempRange'}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    try:
+        query = test5.temp_range_query(borough, start, end, start_hr, end_hr, test5.top_k_arg(request.args))
+        rows, _, _ = await run_query('temp_range', *query)
+        return await render_template_string(TEMP_RANGE_HTML, buckets=test5.bucket_series(rows), borough=borough,
+                                            start=start, end=end, start_hr=start_hr, end_hr=end_hr)
+    except Exception as e:
+        res['code'] = 0
+        res['msg'] = f'Error: {str(e)}'
+        return json_response(res)
+
+
+@app.route('/dashboardData')
+async def dashboard_data():
+    bucket = request.args.get('bucket', 'night').lower()
+    res = {'req': 'dashboardData'}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    if bucket not in TIME_BUCKETS:
+        res['code'] = 0
+        res['msg'] = f"Invalid time bucket. Choose from {list(TIME_BUCKETS.keys())}"
+        return json_response(res)
+    try:
+        t0 = time.time()
+        queries = test5.dashboard_queries(bucket, test5.top_k_arg(request.args, 3))
+        # one pool connection per sub-query, all in flight at once
+        results = await asyncio.gather(*(run_query(name, sql, params) for _, name, sql, params in queries))
+        res.update({
+            'code': 1,
+            'msg': 'ok',
+            'sqltime': round(time.time() - t0, 4),
+            'cached': all(hit for _, _, hit in results),
+            'data': {section: test5.label_buckets(rows) for (section, *_), (rows, _, _) in zip(queries, results)}
+        })
+    except Exception as e:
+        res.update({'code': 0, 'msg': f'Error: {str(e)}'})
+    return json_response(res)
+
+
+@app.route('/cacheStats')
+async def cache_stats():
+    res = {'req': 'cacheStats'}
+    if request.args.get('key') != '123':
+        return invalid_key(res)
+    res.update({
+        'code': 1,
+        'msg': 'ok',
+        'data': {**test5.cache.stats(), 'data_version': test5.data_version,
+                 'connections_open': pool.size if pool else 0,
+                 'backend': 'memory' if test5.memory is not None else 'sql', 'mode': 'async'}
+    })
+    return json_response(res)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the test5.py routes on an async MySQL pool")
+    parser.add_argument("--config", default=test5.config_file)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    app.config['CONFIG_FILE'] = args.config
+    app.run(host=args.host, port=args.port)
@@ -0,0 +1,69 @@
+import csv
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from test3 import CreatedDateDecoder, complaints_file, created_date_format
+
+# Compares the strptime/strftime path test3.py used per complaint row with
+# CreatedDateDecoder, on "Created Date" values from the 311 export (or
+# synthetic ones shaped like it), and checks both give the same answers.
+
+
+def sample_values(path, limit):
+    values = []
+    try:
+        with open(path, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                values.append(row["Created Date"])
+                if len(values) >= limit:
+                    break
+    except FileNotFoundError:
+        start = datetime(2015, 1, 1)
+        for _ in range(limit):
+            dt = start + timedelta(seconds=random.randint(0, 365 * 86400 - 1))
+            values.append(dt.strftime(created_date_format))
+    return values
+
+
+def strptime_path(values):
+    out = []
+    for raw in values:
+        try:
+            dt = datetime.strptime(raw, created_date_format)
+            out.append((dt.strftime("%Y-%m-%d"), str(dt.hour)))
+        except ValueError:
+            out.append(None)
+    return out
+
+
+def decoder_path(values, decoder):
+    out = []
+    for raw in values:
+        decoded = decoder.decode(raw)
+        out.append(None if decoded is None else (decoder.date_str(decoded[0]), str(decoded[1])))
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Created Date decoding")
+    parser.add_argument("--complaints", default=complaints_file)
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    values = sample_values(args.complaints, args.rows)
+
+    t0 = time.perf_counter()
+    expected = strptime_path(values)
+    t1 = time.perf_counter()
+    decoder = CreatedDateDecoder(datetime(2015, 1, 1).toordinal())
+    actual = decoder_path(values, decoder)
+    t2 = time.perf_counter()
+
+    n = len(values)
+    print(f"rows: {n}")
+    print(f"strptime + strftime: {round(t1 - t0, 3)}s ({int(n / (t1 - t0))} rows/sec)")
+    print(f"CreatedDateDecoder:  {round(t2 - t1, 3)}s ({int(n / (t2 - t1))} rows/sec)")
+    print(f"speedup: {round((t1 - t0) / (t2 - t1), 1)}x")
+    print(f"identical: {expected == actual}, rejects: {decoder.rejects}")
@@ -0,0 +1,86 @@
+import argparse
+import gzip
+import random
+import time
+from datetime import date, timedelta
+
+import test5
+from memory_backend import MemoryBackend
+
+# Bytes on the wire and serialization time of test5.py JSON responses:
+# today's jsonify rows against json_body rows and ?format=columnar (orjson
+# when installed), each raw, gzip and brotli (when installed). Payloads are
+# the routes' real result rows from the merged data, or synthetic counts
+# shaped like complaint_rollup when that file is missing.
+
+boroughs = ['MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND']
+
+
+def synthetic_backend(types=200, days=365):
+    rng = random.Random(0)
+    names = [f"COMPLAINT TYPE {i}" for i in range(types)]
+    rows = []
+    for d in range(days):
+        day = (date(2024, 1, 1) + timedelta(days=d)).isoformat()
+        for hour in range(24):
+            for borough in boroughs:
+                temp = round(rng.uniform(-10, 35), 1)
+                for name in rng.sample(names, 12):
+                    rows.append((day, hour, borough, name, temp, rng.randint(1, 40)))
+    return MemoryBackend.from_counts(rows)
+
+
+def payloads(backend):
+    # (route, response dict) as the handlers build them
+    queries = [
+        ('getHourlyComplaints', 'hourly', ()),
+        ('boroughComplaintsByTemp', 'borough_temp', ()),
+        ('topComplaintTypesByTemp', 'top_by_temp', (20,)),
+        ('topComplaintsByTime (all types)', 'top_by_time', (0, 23)),
+        ('complaintsByTempRange', 'temp_range', ('QUEENS', '2000-01-01', '2100-01-01', 0, 23)),
+    ]
+    out = []
+    for route, name, params in queries:
+        rows = test5.label_buckets([dict(row) for row in backend.query(name, params)])
+        out.append((route, {'req': route, 'code': 1, 'msg': 'ok', 'sqltime': 0.0123, 'cached': False, 'data': rows}))
+    return out
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - t0) / repeat * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON response size and serialization")
+    parser.add_argument("--input", default="merged_complaints_weather.csv")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    try:
+        backend = MemoryBackend.from_merged(args.input)
+        source = args.input
+    except FileNotFoundError:
+        backend = synthetic_backend()
+        source = "synthetic rollup counts"
+    print(f"payloads from {source}; serializer: {'orjson' if test5.orjson else 'json'}, "
+          f"brotli: {'yes' if test5.brotli else 'not installed'}")
+
+    with test5.app.app_context():
+        for route, res in payloads(backend):
+            print(f"\n{route}: {len(res['data'])} rows")
+            print(f"  {'format':<22} {'encode ms':>9} {'bytes':>9} {'gzip':>9} {'gzip ms':>8} {'br':>9} {'br ms':>8}")
+            for label, fn in [
+                ("jsonify rows (today)", lambda: test5.app.json.dumps(res).encode()),
+                ("json_body rows", lambda: test5.json_body(res)),
+                ("json_body columnar", lambda: test5.json_body(res, 'columnar')),
+            ]:
+                body, ms = timed(fn, args.repeat)
+                zipped, gzip_ms = timed(lambda: gzip.compress(body, compresslevel=6), args.repeat)
+                line = f"  {label:<22} {ms:>9.3f} {len(body):>9} {len(zipped):>9} {gzip_ms:>8.3f}"
+                if test5.brotli:
+                    br, br_ms = timed(lambda: test5.brotli.compress(body, quality=5), args.repeat)
+                    line += f" {len(br):>9} {br_ms:>8.3f}"
+                print(line)
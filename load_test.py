@@ -0,0 +1,85 @@
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import requests
+
+# Latency of the dashboard routes under concurrent clients, for comparing
+# the sync app (python test5.py) with the async one (async_app.py) on the
+# same database. {start}/{end} in a path get a random date window per
+# request, so those requests mostly miss the result cache and reach MySQL.
+#
+#   python load_test.py --target sync=http://127.0.0.1:5000 --target async=http://127.0.0.1:8000
+
+paths = [
+    "/getHourlyComplaints?key=123",
+    "/dashboardData?key=123&bucket=evening",
+    "/dateHourData?key=123&start={start}&end={end}&start_hr=22&end_hr=3",
+    "/complaintsByTempRange?key=123&start={start}&end={end}&start_hr=8&end_hr=17&borough=QUEENS",
+]
+
+
+def percentile(values, q):
+    # values sorted; nearest-rank
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def random_window(first, last, rng):
+    start = first + timedelta(days=rng.randint(0, (last - first).days))
+    end = min(last, start + timedelta(days=rng.randint(0, 60)))
+    return start.isoformat(), end.isoformat()
+
+
+def run(base_url, concurrency, total, first, last, timeout, seed=0):
+    # total requests spread over concurrency client threads; returns
+    # (latencies in seconds, errors, wall seconds)
+    local = threading.local()
+    rng = random.Random(seed)
+    jobs = []
+    for i in range(total):
+        start, end = random_window(first, last, rng)
+        jobs.append(base_url + paths[i % len(paths)].format(start=start, end=end))
+
+    def fetch(url):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        t0 = time.perf_counter()
+        try:
+            response = session.get(url, timeout=timeout)
+            ok = response.status_code == 200 and b'"code":0' not in response.content.replace(b" ", b"")
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - t0, ok
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, jobs))
+    wall = time.perf_counter() - t0
+    return sorted(seconds for seconds, _ in results), sum(1 for _, ok in results if not ok), wall
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="p50/p99 latency of test5.py routes under concurrency")
+    parser.add_argument("--target", action="append", metavar="NAME=URL",
+                        help="app to test, e.g. sync=http://127.0.0.1:5000 (repeatable)")
+    parser.add_argument("--concurrency", default="1,8,32,64", help="comma-separated client counts")
+    parser.add_argument("--requests", type=int, default=400, help="requests per target and concurrency level")
+    parser.add_argument("--first-day", default="2024-01-01")
+    parser.add_argument("--last-day", default="2024-12-31")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    targets = [t.split("=", 1) for t in args.target or ["sync=http://127.0.0.1:5000", "async=http://127.0.0.1:8000"]]
+    first, last = date.fromisoformat(args.first_day), date.fromisoformat(args.last_day)
+    print(f"{'target':<8} {'clients':>7} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        for name, url in targets:
+            # same request sequence for every target at this level
+            latencies, errors, wall = run(url.rstrip("/"), concurrency, args.requests, first, last, args.timeout,
+                                          seed=concurrency)
+            print(f"{name:<8} {concurrency:>7} {len(latencies):>8} {errors:>6} {len(latencies) / wall:>8.1f} "
+                  f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f}")
@@ -0,0 +1,369 @@
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from merged_store import MergedStore, read_merged
+from temp_buckets import TempBuckets
+from weather_index import BOROUGHS
+
+# Answers the test5.py endpoint queries from memory. Complaints are held as
+# integer-coded columns (day, hour, borough, complaint_type) plus the hourly
+# temperature and a weight, one entry per distinct key, and every query is a
+# boolean mask followed by an np.bincount over the grouped codes. Loaded
+# from the merged file / columnar store / partitions, or from the
+# complaint_rollup table, whose counts become the weights.
+#
+# Date-range routes are answered from PrefixCube cumulative counts instead
+# of masks, so their cost does not depend on how many days the range spans.
+#
+# Each method returns the rows the matching SQL in test5.py would, as
+# DictCursor-style dicts in the same ORDER BY, ties included. Names sort
+# in plain code point order. That is what the SQL's complaint_type COLLATE
+# utf8mb4_bin tie-breaks give, not the table's case-insensitive default
+# collation. ORDER BY borough only sees the five upper-case boroughs, so
+# the collation makes no difference there. Temperature rows carry the
+# numeric 'bucket' of the TempBuckets they were built with.
+
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value.strip(), '%Y-%m-%d').toordinal()
+    except (AttributeError, ValueError):
+        return None
+
+
+def _encode(rows, boroughs, types):
+    # Column arrays for (date str, hour, borough, complaint_type, temperature
+    # or None, count) rows; boroughs/types are extended with new names
+    ordinals = {}
+    cols = ([], [], [], [], [], [])
+    for d, h, b, c, t, n in rows:
+        o = ordinals.get(d)
+        if o is None:
+            o = ordinals[d] = datetime.strptime(d, '%Y-%m-%d').toordinal()
+        for col, value in zip(cols, (o, h, boroughs.setdefault(b, len(boroughs)),
+                                     types.setdefault(c, len(types)), np.nan if t is None else t, n)):
+            col.append(value)
+    dtypes = (np.int64, np.int64, np.int64, np.int64, np.float64, np.float64)
+    return tuple(np.array(col, dtype=dtype) for col, dtype in zip(cols, dtypes))
+
+
+class PrefixCube:
+    # cum[d, h, g] is the count for hour h and group g over days before d,
+    # so any day range [lo, hi] is cum[hi + 1] - cum[lo]: two lookups
+    # whatever the width of the range.
+    def __init__(self, cum):
+        self.cum = cum
+
+    @classmethod
+    def build(cls, day, hour, group, weight, days, groups):
+        cum = np.zeros((days + 1, 24, groups), dtype=np.int32)
+        cum[1:] = np.cumsum(cls._daily(day, hour, group, weight, days, groups), axis=0)
+        return cls(cum)
+
+    @staticmethod
+    def _daily(day, hour, group, weight, days, groups):
+        flat = (day.astype(np.int64) * 24 + hour) * groups + group
+        return np.bincount(flat, weights=weight, minlength=days * 24 * groups).astype(np.int32).reshape(
+            days, 24, groups)
+
+    @property
+    def days(self):
+        return self.cum.shape[0] - 1
+
+    def update(self, first, day, hour, group, weight, days):
+        # Entries are the complete counts for days >= first; earlier
+        # prefixes are kept and only the tail is summed again. Days between
+        # the old end and first (a gap in the data) carry the last prefix.
+        if days > self.days:
+            grown = np.empty((days + 1, *self.cum.shape[1:]), dtype=self.cum.dtype)
+            grown[:self.cum.shape[0]] = self.cum
+            grown[self.cum.shape[0]:] = self.cum[-1]
+            self.cum = grown
+        else:
+            self.cum = self.cum[:days + 1]
+        daily = self._daily(day - first, hour, group, weight, days - first, self.cum.shape[2])
+        self.cum[first + 1:] = self.cum[first] + np.cumsum(daily, axis=0)
+
+    def window(self, lo, hi):
+        # (24, groups) counts for days lo..hi inclusive, clipped to the cube
+        lo, hi = max(lo, 0), min(hi, self.days - 1)
+        if lo > hi:
+            return np.zeros(self.cum.shape[1:], dtype=self.cum.dtype)
+        return self.cum[hi + 1] - self.cum[lo]
+
+
+def top_per_group(rows, group, k):
+    # rows sorted by group, then cnt descending: the first k of each group,
+    # as TOP_K_SQL in test5.py returns them. k=None keeps every row.
+    if k is None:
+        return rows
+    kept, seen = [], {}
+    for row in rows:
+        n = seen.get(row[group], 0)
+        if n < k:
+            kept.append(row)
+            seen[row[group]] = n + 1
+    return kept
+
+
+def hour_mask(start_hr, end_hr):
+    hours = np.arange(24)
+    if start_hr <= end_hr:
+        return (hours >= start_hr) & (hours <= end_hr)
+    return (hours >= start_hr) | (hours <= end_hr)
+
+
+class MemoryBackend:
+    def __init__(self, ordinals, hours, boroughs, types, temps, weights, borough_names, type_names,
+                 type_cube=False, buckets=None):
+        self.base_ordinal = int(ordinals.min()) if len(ordinals) else 0
+        self.day = (ordinals - self.base_ordinal).astype(np.int32)
+        self.hour = hours.astype(np.int64)
+        self.borough = boroughs.astype(np.int64)
+        self.type = types.astype(np.int64)
+        self.temp = temps.astype(np.float64)
+        self.weight = weights.astype(np.float64)
+        self.borough_names = list(borough_names)
+        self.type_names = list(type_names)
+        self.type_cube = type_cube
+        self.buckets = buckets or TempBuckets()
+        self._derive()
+        self._build_cubes()
+
+    def _derive(self):
+        # one bucket number per entry, -1 without a temperature
+        self.bucket = self.buckets.digitize(self.temp)
+        self.has_temp = self.bucket >= 0
+        five = [i for i, b in enumerate(self.borough_names) if b in BOROUGHS]
+        self.in_five = np.isin(self.borough, five)
+        self.days = int(self.day.max()) + 1 if len(self.day) else 0
+
+    def _combos(self):
+        # (borough, bucket, type) code per entry. The cube over these serves
+        # /complaintsByTempRange; it is days x 24 x combinations int32, so
+        # it is only built when type_cube is set. Entries without a
+        # temperature get -1, which decodes to no borough.
+        combos = (self.borough * len(self.buckets) + self.bucket) * len(self.type_names) + self.type
+        return np.where(self.has_temp, combos, -1)
+
+    def _build_cubes(self):
+        self.borough_cube = PrefixCube.build(self.day, self.hour, self.borough, self.weight, self.days,
+                                             len(self.borough_names))
+        self.combo_cube = None
+        if self.type_cube:
+            # only the combinations that occur get a column
+            self.combo_keys, combo = np.unique(self._combos(), return_inverse=True)
+            self.combo_cube = PrefixCube.build(self.day, self.hour, combo.reshape(-1), self.weight, self.days,
+                                               len(self.combo_keys))
+
+    def replace_from(self, since, rows):
+        # Swaps in fresh counts for every day from since on (rows as for
+        # from_counts) and updates the cubes from that day forward only.
+        first = parse_day(since) - self.base_ordinal
+        n_boroughs, n_types = len(self.borough_names), len(self.type_names)
+        boroughs = {b: i for i, b in enumerate(self.borough_names)}
+        types = {c: i for i, c in enumerate(self.type_names)}
+        ordinals, hours, b_codes, t_codes, temps, weights = _encode(rows, boroughs, types)
+        if first <= 0:
+            self.__init__(ordinals, hours, b_codes, t_codes, temps, weights, list(boroughs), list(types),
+                          self.type_cube, self.buckets)
+            return
+        keep = self.day < first
+        self.day = np.concatenate([self.day[keep], (ordinals - self.base_ordinal).astype(np.int32)])
+        self.hour = np.concatenate([self.hour[keep], hours.astype(np.int64)])
+        self.borough = np.concatenate([self.borough[keep], b_codes.astype(np.int64)])
+        self.type = np.concatenate([self.type[keep], t_codes.astype(np.int64)])
+        self.temp = np.concatenate([self.temp[keep], temps.astype(np.float64)])
+        self.weight = np.concatenate([self.weight[keep], weights.astype(np.float64)])
+        self.borough_names, self.type_names = list(boroughs), list(types)
+        self._derive()
+        self.days = max(self.days, first)
+        tail = self.day >= first
+        if len(self.borough_names) != n_boroughs or len(self.type_names) != n_types:
+            self._build_cubes()
+            return
+        self.borough_cube.update(first, self.day[tail], self.hour[tail], self.borough[tail], self.weight[tail],
+                                 self.days)
+        if self.combo_cube is not None:
+            combos = self._combos()
+            if not np.isin(combos[tail], self.combo_keys).all():
+                self._build_cubes()
+                return
+            self.combo_cube.update(first, self.day[tail], self.hour[tail],
+                                   np.searchsorted(self.combo_keys, combos[tail]), self.weight[tail], self.days)
+
+    def _day_range(self, start, end):
+        lo, hi = parse_day(start), parse_day(end)
+        if lo is None or hi is None:
+            return 0, -1
+        return lo - self.base_ordinal, hi - self.base_ordinal
+
+    @classmethod
+    def from_merged(cls, path, type_cube=False, buckets=None):
+        # Any input read_merged accepts; the columnar store is used as-is
+        try:
+            store = MergedStore(path)
+        except (FileNotFoundError, NotADirectoryError):
+            store = None
+        if store is not None:
+            # float32 -> the decimal the CSV carried, so 9.9 is not below a 9.9 edge
+            values, temp_codes = np.unique(np.asarray(store.temperature_C), return_inverse=True)
+            temps = values.astype(str).astype(np.float64)[temp_codes.reshape(-1)]
+            return cls(
+                store.date.astype(np.int64) + store.base_ordinal, np.asarray(store.hour),
+                np.asarray(store.borough), np.asarray(store.codes['complaint_type']),
+                temps, np.ones(store.rows), store.boroughs,
+                store.vocabs['complaint_type'], type_cube, buckets,
+            )
+        counts = {}
+        for d, h, b, t, c, _, _ in read_merged(path):
+            key = (d, h, b, c, t)
+            counts[key] = counts.get(key, 0) + 1
+        return cls.from_counts(((*key, n) for key, n in counts.items()), type_cube, buckets)
+
+    @classmethod
+    def from_rollup(cls, cur, type_cube=False, buckets=None):
+        return cls.from_counts(cls.rollup_rows(cur), type_cube, buckets)
+
+    @classmethod
+    def from_counts(cls, rows, type_cube=False, buckets=None):
+        # rows: (date str, hour, borough, complaint_type, temperature or None, count)
+        boroughs, types = {}, {}
+        return cls(*_encode(rows, boroughs, types), list(boroughs), list(types), type_cube, buckets)
+
+    @staticmethod
+    def rollup_rows(cur, since=None):
+        sql = "SELECT date, hour, borough, complaint_type, temperature_C, cnt FROM complaint_rollup"
+        cur.execute(sql + (" WHERE date >= %s" if since else ""), (since,) if since else ())
+        return [
+            (row['date'].isoformat(), row['hour'], row['borough'], row['complaint_type'], row['temperature_C'],
+             row['cnt'])
+            for row in cur.fetchall()
+        ]
+
+    def __len__(self):
+        return len(self.day)
+
+    def _days(self, start, end):
+        lo, hi = parse_day(start), parse_day(end)
+        if lo is None or hi is None:
+            return np.zeros(len(self), dtype=bool)
+        return (self.day >= lo - self.base_ordinal) & (self.day <= hi - self.base_ordinal)
+
+    def _hours(self, start_hr, end_hr):
+        if start_hr <= end_hr:
+            return (self.hour >= start_hr) & (self.hour <= end_hr)
+        return (self.hour >= start_hr) | (self.hour <= end_hr)
+
+    def _group(self, mask, *keys):
+        # keys: (code array, size). Returns [(codes..., count)] for the
+        # groups with rows, like GROUP BY.
+        code = np.zeros(int(mask.sum()), dtype=np.int64)
+        sizes = []
+        for values, size in keys:
+            code = code * size + values[mask]
+            sizes.append(size)
+        total = int(np.prod(sizes))
+        counts = np.bincount(code, weights=self.weight[mask], minlength=total)
+        present = np.flatnonzero(counts)
+        parts = np.unravel_index(present, sizes)
+        return list(zip(*(p.tolist() for p in parts), counts[present].astype(np.int64).tolist()))
+
+    def _b(self):
+        return self.borough, len(self.borough_names)
+
+    def _t(self):
+        return self.type, len(self.type_names)
+
+    def _k(self):
+        return self.bucket, len(self.buckets)
+
+    def hourly(self):
+        rows = self._group(self.in_five, (self.hour, 24), self._b())
+        rows = [{'hr': h, 'borough': self.borough_names[b], 'cnt': n} for h, b, n in rows]
+        return sorted(rows, key=lambda r: (r['hr'], r['borough']))
+
+    def hour_borough(self, hour):
+        rows = self._group(self.in_five & (self.hour == hour), self._b())
+        return sorted(({'borough': self.borough_names[b], 'cnt': n} for b, n in rows), key=lambda r: r['borough'])
+
+    def date_range(self, start, end):
+        counts = self.borough_cube.window(*self._day_range(start, end)).sum(axis=0)
+        rows = [{'borough': name, 'cnt': int(counts[b])} for b, name in enumerate(self.borough_names)
+                if name in BOROUGHS and counts[b]]
+        return sorted(rows, key=lambda r: r['borough'])
+
+    def date_hour(self, start, end, start_hr, end_hr):
+        counts = self.borough_cube.window(*self._day_range(start, end))
+        hours = hour_mask(start_hr, end_hr)
+        rows = [{'hr': h, 'borough': name, 'cnt': int(counts[h, b])}
+                for h in range(24) if hours[h]
+                for b, name in enumerate(self.borough_names) if name in BOROUGHS and counts[h, b]]
+        return sorted(rows, key=lambda r: (r['hr'], r['borough']))
+
+    def top_by_time(self, start_hr, end_hr, k=None):
+        mask = self.in_five & (self.hour >= start_hr) & (self.hour <= end_hr)
+        rows = self._group(mask, self._b(), self._t())
+        rows = [{'borough': self.borough_names[b], 'complaint_type': self.type_names[c], 'cnt': n}
+                for b, c, n in rows]
+        rows.sort(key=lambda r: (r['borough'], -r['cnt'], r['complaint_type']))
+        return top_per_group(rows, 'borough', k)
+
+    def temp_bucket(self):
+        rows = self._group(self.has_temp, self._k())
+        rows = [{'bucket': k, 'count': n} for k, n in rows]
+        return sorted(rows, key=lambda r: (-r['count'], r['bucket']))
+
+    def top_by_temp(self, k=None):
+        # every bucket in one pass, the top k types of each
+        rows = self._group(self.has_temp, self._k(), self._t())
+        rows = [{'bucket': b, 'complaint_type': self.type_names[c], 'cnt': n} for b, c, n in rows]
+        rows.sort(key=lambda r: (r['bucket'], -r['cnt'], r['complaint_type']))
+        return top_per_group(rows, 'bucket', k)
+
+    def borough_temp(self):
+        rows = self._group(self.has_temp & self.in_five, self._k(), self._b())
+        rows = [{'borough': self.borough_names[b], 'bucket': k, 'count': n} for k, b, n in rows]
+        return sorted(rows, key=lambda r: (r['bucket'], -r['count'], r['borough']))
+
+    def temp_range(self, borough, start, end, start_hr, end_hr, k=None):
+        names = [i for i, b in enumerate(self.borough_names) if b.upper() == (borough or '').strip().upper()]
+        if self.combo_cube is None:
+            mask = (self.has_temp & np.isin(self.borough, names) & self._days(start, end)
+                    & self._hours(start_hr, end_hr))
+            rows = self._group(mask, self._k(), self._t())
+        else:
+            counts = self.combo_cube.window(*self._day_range(start, end))[hour_mask(start_hr, end_hr)].sum(axis=0)
+            n_types = len(self.type_names)
+            b, rest = np.divmod(self.combo_keys, len(self.buckets) * n_types)
+            bucket, c = np.divmod(rest, n_types)
+            keep = np.isin(b, names) & (counts > 0)
+            rows = list(zip(bucket[keep].tolist(), c[keep].tolist(), counts[keep].tolist()))
+        rows = [{'bucket': b, 'complaint_type': self.type_names[c], 'cnt': n} for b, c, n in rows]
+        rows.sort(key=lambda r: (r['bucket'], -r['cnt'], r['complaint_type']))
+        return top_per_group(rows, 'bucket', k)
+
+    def query(self, name, params):
+        return getattr(self, name)(*params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the merged data into memory and time each endpoint query")
+    parser.add_argument("--input", default="merged_complaints_weather.csv")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    backend = MemoryBackend.from_merged(args.input)
+    print(f"Loaded {len(backend)} keys in {round(time.time() - t0, 2)}s")
+    for name, params in [
+        ("hourly", ()), ("hour_borough", (8,)), ("date_range", ("2024-01-01", "2024-12-31")),
+        ("date_hour", ("2024-01-01", "2024-12-31", 22, 3)), ("top_by_time", (0, 5, 3)), ("temp_bucket", ()),
+        ("top_by_temp", (20,)), ("borough_temp", ()),
+        ("temp_range", ("QUEENS", "2024-01-01", "2024-12-31", 8, 17)),
+    ]:
+        t0 = time.time()
+        rows = backend.query(name, params)
+        print(f"  {name:<14} {len(rows):>5} rows in {round((time.time() - t0) * 1000, 2)} ms")
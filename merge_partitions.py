@@ -0,0 +1,237 @@
+import csv
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import date
+
+from test3 import CreatedDateDecoder, chunk_ranges, complaint_columns, complaints_file, fieldnames, \
+    iter_range_lines, load_weather, print_stats, merge_complaints, project_columns, read_header, \
+    skipped_keys_file, weather_file, write_skipped_keys
+
+# Month-partitioned merge output with a manifest, so a refresh only redoes
+# the months whose inputs changed.
+#
+# The 311 file is cut into record-aligned blocks of ~BLOCK_SIZE bytes, each
+# stored in the manifest with a checksum and the months it contains. On a
+# rerun, blocks whose bytes are unchanged are not parsed again; new blocks
+# (appended data) and months whose weather slice changed mark their months
+# dirty, and only those partitions are rebuilt from the blocks that hold
+# their rows.
+
+partition_dir = "merged_partitions"
+manifest_name = "manifest.json"
+BLOCK_SIZE = 64 << 20
+
+
+def file_checksum(path, start, end):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            buf = f.read(min(1 << 20, remaining))
+            if not buf:
+                break
+            h.update(buf)
+            remaining -= len(buf)
+    return h.hexdigest()
+
+
+def weather_checksum(weather, month):
+    # Version of the weather a month was joined against: the index slice for
+    # that month's days plus where it sits inside the month.
+    year, mon = int(month[:4]), int(month[5:7])
+    first = date(year, mon, 1).toordinal() - weather.base_ordinal
+    last = date(year + mon // 12, mon % 12 + 1, 1).toordinal() - weather.base_ordinal
+    lo, hi = max(first, 0), max(min(last, weather.days), max(first, 0))
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{month}:{lo - first}:{hi - lo}".encode())
+    h.update(weather.temps[lo:hi].tobytes())
+    h.update(weather.present[lo:hi].tobytes())
+    return h.hexdigest()
+
+
+def load_manifest(out_dir):
+    path = os.path.join(out_dir, manifest_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(out_dir, manifest):
+    path = os.path.join(out_dir, manifest_name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def month_router(base_ordinal):
+    decoder = CreatedDateDecoder(base_ordinal)
+
+    def month_of(row):
+        if row is None:
+            return None
+        decoded = decoder.decode(row[0])
+        return None if decoded is None else decoder.date_str(decoded[0])[:7]
+
+    return month_of
+
+
+def iter_block_rows(path, header, block):
+    return project_columns(iter_range_lines(path, block["start"], block["end"]), header, complaint_columns)
+
+
+def plan_blocks(path, header, manifest):
+    # Reuse the previous run's blocks while their bytes still match; anything
+    # after the last matching block is cut into new blocks.
+    old_blocks = manifest.get("blocks", []) if manifest.get("header") == header else []
+    size = os.path.getsize(path)
+    kept = []
+    for block in old_blocks:
+        if block["end"] > size or file_checksum(path, block["start"], block["end"]) != block["checksum"]:
+            break
+        kept.append(block)
+    if len(kept) < len(old_blocks):
+        # Something before the end changed in place; offsets after it can't
+        # be trusted, so start over.
+        kept = []
+
+    start = kept[-1]["end"] if kept else None
+    begin = start if start is not None else len(header_line(path))
+    n_blocks = max(1, -(-(size - begin) // BLOCK_SIZE))
+    new = [{"start": a, "end": b} for a, b in chunk_ranges(path, n_blocks, start=start)] if size > begin else []
+    return kept, new
+
+
+def header_line(path):
+    with open(path, "rb") as f:
+        return f.readline()
+
+
+def scan_block(path, header, block, month_of):
+    months = {}
+    rejects = 0
+    for row in iter_block_rows(path, header, block):
+        month = month_of(row)
+        if month is None:
+            rejects += 1
+        else:
+            months[month] = months.get(month, 0) + 1
+    block["checksum"] = file_checksum(path, block["start"], block["end"])
+    block["months"] = months
+    block["rejects"] = rejects
+    return block
+
+
+def run(complaints_path, weather, out_dir=partition_dir):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    header = read_header(complaints_path)
+    month_of = month_router(weather.base_ordinal)
+
+    kept, new = plan_blocks(complaints_path, header, manifest)
+    for block in new:
+        scan_block(complaints_path, header, block, month_of)
+    blocks = kept + new
+    print(f"Blocks: {len(kept)} unchanged, {len(new)} scanned")
+
+    all_months = sorted({m for b in blocks for m in b["months"]})
+    old_parts = manifest.get("partitions", {})
+    weather_versions = {m: weather_checksum(weather, m) for m in all_months}
+    dirty = {m for b in new for m in b["months"]}
+    for m in all_months:
+        part = old_parts.get(m)
+        if (part is None or part["weather"] != weather_versions[m]
+                or not os.path.exists(os.path.join(out_dir, part["file"]))):
+            dirty.add(m)
+
+    partitions = {m: old_parts[m] for m in all_months if m not in dirty}
+    if dirty:
+        rebuild(complaints_path, header, weather, blocks, dirty, out_dir, month_of, partitions, weather_versions)
+
+    for m, part in old_parts.items():
+        if m not in partitions and os.path.exists(os.path.join(out_dir, part["file"])):
+            os.remove(os.path.join(out_dir, part["file"]))
+
+    manifest = {
+        "source": os.path.abspath(complaints_path),
+        "header": header,
+        "blocks": blocks,
+        "partitions": partitions,
+    }
+    save_manifest(out_dir, manifest)
+    print(f"Partitions: {len(partitions)} total, {len(dirty)} rebuilt ({', '.join(sorted(dirty)) or 'none'})")
+    return manifest
+
+
+def rebuild(path, header, weather, blocks, dirty, out_dir, month_of, partitions, weather_versions):
+    needed = [b for b in blocks if dirty & set(b["months"])]
+    rows = (
+        row
+        for block in needed
+        for row in iter_block_rows(path, header, block)
+        if month_of(row) in dirty
+    )
+
+    files = {}
+    writers = {}
+    merged = {m: 0 for m in dirty}
+    for m in sorted(dirty):
+        files[m] = open(os.path.join(out_dir, f"{m}.csv.tmp"), "w", newline="")
+        writers[m] = csv.writer(files[m])
+        writers[m].writerow(fieldnames)
+
+    stats = {"merged": 0, "skipped": 0, "missing_keys": {}, "rejects": {}}
+    for out in merge_complaints(rows, weather, stats):
+        month = out[0][:7]
+        writers[month].writerow(out)
+        merged[month] += 1
+
+    missing = {m: [] for m in dirty}
+    for key, count in sorted(stats["missing_keys"].items()):
+        missing[key[0][:7]].append([*key, count])
+
+    for m in sorted(dirty):
+        files[m].close()
+        os.replace(os.path.join(out_dir, f"{m}.csv.tmp"), os.path.join(out_dir, f"{m}.csv"))
+        partitions[m] = {
+            "file": f"{m}.csv",
+            "weather": weather_versions[m],
+            "source_ranges": [[b["start"], b["end"]] for b in blocks if m in b["months"]],
+            "rows": sum(b["months"].get(m, 0) for b in blocks),
+            "merged": merged[m],
+            "skipped": sum(k[-1] for k in missing[m]),
+            "missing_keys": missing[m],
+        }
+
+
+def summarize(manifest):
+    stats = {"merged": 0, "skipped": 0, "missing_keys": {}, "rejects": {}}
+    for part in manifest["partitions"].values():
+        stats["merged"] += part["merged"]
+        stats["skipped"] += part["skipped"]
+        for d, h, b, count in part["missing_keys"]:
+            stats["missing_keys"][(d, h, b)] = count
+    rejected = sum(b["rejects"] for b in manifest["blocks"])
+    if rejected:
+        stats["skipped"] += rejected
+        stats["rejects"]["bad or missing date"] = rejected
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental month-partitioned merge of 311 complaints with weather")
+    parser.add_argument("--weather", default=weather_file)
+    parser.add_argument("--complaints", default=complaints_file)
+    parser.add_argument("--output-dir", default=partition_dir)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    manifest = run(args.complaints, load_weather(args.weather), args.output_dir)
+    stats = summarize(manifest)
+    write_skipped_keys(skipped_keys_file, stats["missing_keys"])
+    print_stats(stats)
+    print(f"Done in {round(time.time() - t0, 2)}s")
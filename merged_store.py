@@ -0,0 +1,175 @@
+import csv
+import argparse
+import json
+import os
+from array import array
+from datetime import date, datetime
+
+import numpy as np
+
+from weather_index import BOROUGHS, BOROUGH_IDS
+
+# Columnar, dictionary-encoded copy of merged_complaints_weather.csv: one .npy
+# file per column in a directory, dates as day offsets from base_date,
+# hour/borough as uint8, temperature as float32 (NaN = none) and the text
+# columns as integer codes into vocab_<column>.npy. Numeric columns load
+# memory-mapped, so opening the store costs almost nothing.
+
+columnar_dir = "merged_complaints_weather.cols"
+text_columns = ["complaint_type", "descriptor", "location_type"]
+
+
+class ColumnarWriter:
+    def __init__(self, path):
+        self.path = path
+        self.days = array("i")
+        self.hours = array("B")
+        self.boroughs = array("B")
+        self.temps = array("f")
+        self.codes = {c: array("I") for c in text_columns}
+        self.vocabs = {c: {} for c in text_columns}
+        self._ordinals = {}
+        self._temps = {}
+
+    def write(self, row):
+        # row is a merged row in test3.fieldnames order
+        day, hour, borough, temp, complaint, descriptor, location = row
+        ordinal = self._ordinals.get(day)
+        if ordinal is None:
+            ordinal = self._ordinals[day] = datetime.strptime(day, "%Y-%m-%d").toordinal()
+        value = self._temps.get(temp)
+        if value is None:
+            value = self._temps[temp] = float(temp) if temp != "" else float("nan")
+        self.days.append(ordinal)
+        self.hours.append(int(hour))
+        self.boroughs.append(BOROUGH_IDS[borough])
+        self.temps.append(value)
+        for column, text in zip(text_columns, (complaint, descriptor, location)):
+            vocab = self.vocabs[column]
+            code = vocab.get(text)
+            if code is None:
+                code = vocab[text] = len(vocab)
+            self.codes[column].append(code)
+
+    def writerows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def close(self):
+        os.makedirs(self.path, exist_ok=True)
+        ordinals = np.frombuffer(self.days, dtype=np.int32)
+        base = int(ordinals.min()) if len(ordinals) else date.today().toordinal()
+        span = int(ordinals.max()) - base if len(ordinals) else 0
+        day_dtype = np.uint16 if span < 1 << 16 else np.uint32
+        self._save("date", (ordinals - base).astype(day_dtype))
+        self._save("hour", np.frombuffer(self.hours, dtype=np.uint8))
+        self._save("borough", np.frombuffer(self.boroughs, dtype=np.uint8))
+        self._save("temperature_C", np.frombuffer(self.temps, dtype=np.float32))
+        for column in text_columns:
+            codes = np.frombuffer(self.codes[column], dtype=np.uint32)
+            code_dtype = np.uint16 if len(self.vocabs[column]) <= 1 << 16 else np.uint32
+            self._save(column, codes.astype(code_dtype))
+            self._save(f"vocab_{column}", np.array(list(self.vocabs[column]), dtype=str))
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"rows": len(ordinals), "base_ordinal": base, "boroughs": BOROUGHS}, f)
+
+    def _save(self, name, values):
+        np.save(os.path.join(self.path, f"{name}.npy"), values, allow_pickle=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+
+class MergedStore:
+    def __init__(self, path=columnar_dir):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.rows = meta["rows"]
+        self.base_ordinal = meta["base_ordinal"]
+        self.boroughs = meta["boroughs"]
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+        self.date = load("date")
+        self.hour = load("hour")
+        self.borough = load("borough")
+        self.temperature_C = load("temperature_C")
+        self.codes = {c: load(c) for c in text_columns}
+        self.vocabs = {c: np.load(os.path.join(path, f"vocab_{c}.npy")).tolist() for c in text_columns}
+
+    def date_strs(self):
+        n_days = int(self.date.max()) + 1 if self.rows else 0
+        return [date.fromordinal(self.base_ordinal + d).strftime("%Y-%m-%d") for d in range(n_days)]
+
+    def iter_rows(self, chunk=1 << 16):
+        # Rows shaped like test4.py's insert tuples:
+        # (date, hour, borough, temperature_C or None, complaint_type, descriptor, location_type)
+        dates = self.date_strs()
+        vocabs = [self.vocabs[c] for c in text_columns]
+        # float32 -> the shortest decimal that round-trips, i.e. the value the
+        # CSV carried ("13.2", not 13.199999809265137)
+        temp_values = {}
+        for start in range(0, self.rows, chunk):
+            stop = min(start + chunk, self.rows)
+            cols = zip(
+                self.date[start:stop].tolist(),
+                self.hour[start:stop].tolist(),
+                self.borough[start:stop].tolist(),
+                self.temperature_C[start:stop].tolist(),
+                *(self.codes[c][start:stop].tolist() for c in text_columns),
+            )
+            for d, h, b, t, c0, c1, c2 in cols:
+                if t != t:
+                    t = None
+                elif t != 0:
+                    value = temp_values.get(t)
+                    if value is None:
+                        value = temp_values[t] = float(str(np.float32(t)))
+                    t = value
+                yield dates[d], h, self.boroughs[b], t, vocabs[0][c0], vocabs[1][c1], vocabs[2][c2]
+
+
+def read_merged(path):
+    # Loader rows from the merged CSV, a columnar store directory or the
+    # month partitions written by merge_partitions.py
+    if os.path.isdir(path):
+        manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                partitions = json.load(f)["partitions"]
+            for month in sorted(partitions):
+                yield from read_merged(os.path.join(path, partitions[month]["file"]))
+        else:
+            yield from MergedStore(path).iter_rows()
+        return
+    with open(path, encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield (
+                row["date"],
+                int(row["hour"]),
+                row["borough"],
+                float(row["temperature_C"]) if row["temperature_C"] else None,
+                row["complaint_type"],
+                row["descriptor"],
+                row["location_type"],
+            )
+
+
+def convert_csv(csv_path, out_path):
+    with open(csv_path, "r", newline="") as f, ColumnarWriter(out_path) as writer:
+        reader = csv.reader(f)
+        next(reader)
+        writer.writerows(reader)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert merged_complaints_weather.csv to the columnar store")
+    parser.add_argument("--input", default="merged_complaints_weather.csv")
+    parser.add_argument("--output", default=columnar_dir)
+    args = parser.parse_args()
+
+    convert_csv(args.input, args.output)
+    store = MergedStore(args.output)
+    print(f"Wrote {store.rows} rows to {args.output}")
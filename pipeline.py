@@ -0,0 +1,96 @@
+import csv
+import argparse
+import os
+import time
+from datetime import datetime
+
+import test1
+from test2 import clean_row
+from test3 import complaints_file, fieldnames, index_weather, merge_complaints, output_file, print_stats, \
+    read_complaints, skipped_keys_file, weather_file, write_skipped_keys
+
+# fetch -> clean -> index -> merge in one process. Weather rows are handed
+# from stage to stage as lists, so nothing is formatted to text and parsed
+# back; the only files touched are the 311 input and the merged output.
+
+weather_header = ["date", "hour", "borough", "zipcode", "temperature_C"]
+
+
+def clean_stage(rows, stats):
+    stats.update(fixed=0, invalid=0)
+    for row in rows:
+        row, ok = clean_row(list(row))
+        if ok:
+            stats["fixed"] += 1
+        else:
+            stats["invalid"] += 1
+        yield row
+
+
+def tee_csv(rows, path, header):
+    # Debug only: materialize a stage to disk while passing rows through.
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow(row)
+            yield row
+
+
+def run(start, end, complaints_path=complaints_file, out_path=output_file, debug_dir=None, **fetch_opts):
+    fetch_stats = {}
+    clean_stats = {}
+    merge_stats = {"merged": 0, "skipped": 0, "missing_keys": {}, "rejects": {}}
+
+    raw = test1.iter_weather(start, end, stats=fetch_stats, **fetch_opts)
+    if debug_dir:
+        raw = tee_csv(raw, os.path.join(debug_dir, "nyc_hourly_weather.csv"), weather_header)
+    cleaned = clean_stage(raw, clean_stats)
+    if debug_dir:
+        cleaned = tee_csv(cleaned, os.path.join(debug_dir, weather_file), weather_header)
+
+    t0 = time.time()
+    weather = index_weather(cleaned)
+    t1 = time.time()
+
+    with open(complaints_path, "r") as cf, open(out_path, "w", newline="") as outf:
+        writer = csv.writer(outf)
+        writer.writerow(fieldnames)
+        writer.writerows(merge_complaints(read_complaints(cf), weather, merge_stats))
+    t2 = time.time()
+
+    write_skipped_keys(skipped_keys_file, merge_stats["missing_keys"])
+    print(f"Weather: fetched {fetch_stats['fetched']}, from cache {fetch_stats['cached']}, "
+          f"failed {fetch_stats['failed']} in {round(t1 - t0, 2)}s")
+    print(f"Temperatures fixed: {clean_stats['fixed']}, invalid: {clean_stats['invalid']}")
+    print_stats(merge_stats)
+    print(f"Merge done in {round(t2 - t1, 2)}s")
+    return merge_stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch, clean and merge weather into the 311 data in one pass")
+    parser.add_argument("--start", default=test1.start_date.strftime("%Y-%m-%d"))
+    parser.add_argument("--end", default=test1.end_date.strftime("%Y-%m-%d"))
+    parser.add_argument("--complaints", default=complaints_file)
+    parser.add_argument("--output", default=output_file)
+    parser.add_argument("--base-url", default=test1.BASE_URL)
+    parser.add_argument("--workers", type=int, default=test1.MAX_IN_FLIGHT)
+    parser.add_argument("--rate", type=float, default=test1.RATE_PER_SEC)
+    parser.add_argument("--cache", default=test1.cache_file)
+    parser.add_argument("--debug-dir", help="also write the raw and cleaned weather CSVs here")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    run(
+        datetime.strptime(args.start, "%Y-%m-%d"),
+        datetime.strptime(args.end, "%Y-%m-%d"),
+        args.complaints,
+        args.output,
+        debug_dir=args.debug_dir,
+        base_url=args.base_url,
+        workers=args.workers,
+        rate=args.rate,
+        cache_path=args.cache,
+    )
+    print(f"Done in {round(time.time() - t0, 2)}s")
@@ -0,0 +1,139 @@
+import argparse
+import sys
+
+import test5
+from test4 import ROLLUP_SELECT_SQL, config_file, connect, load_config, rollup_ddl, rollup_table, \
+    secondary_indexes
+
+# Creates nyc_complaints and complaint_rollup with their indexes and checks
+# that every test5.py endpoint query, and the rollup refresh, can be answered
+# without a full table or index scan. The endpoints read the rollup (see
+# rollup_ddl in test4.py), so the only query on the raw rows is the
+# refresh's recount of a date range, and nyc_complaints carries just the
+# index for it: date first for the range, then the grouped columns and the
+# temperature, so the recount reads the index alone. The incremental
+# loader's stale-row delete uses its date prefix too. Every other secondary
+# index would only slow the loader down.
+#
+# borough stays VARCHAR rather than ENUM so ORDER BY borough remains
+# alphabetical.
+
+indexes = {
+    "idx_date_hour_borough": ["date", "hour", "borough", "complaint_type", "temperature_C"],
+}
+# raw-table indexes of earlier versions that no query reads; provision drops them
+retired_indexes = ["idx_hour_borough_type", "idx_temp_borough_type", "idx_borough_date_hour"]
+
+
+def complaints_ddl(table):
+    index_lines = "".join(f",\n    INDEX {name} ({', '.join(cols)})" for name, cols in indexes.items())
+    return f"""CREATE TABLE IF NOT EXISTS {table} (
+    id INT UNSIGNED NOT NULL AUTO_INCREMENT,
+    date DATE NOT NULL,
+    hour TINYINT UNSIGNED NOT NULL,
+    borough VARCHAR(16) NOT NULL,
+    temperature_C FLOAT NULL,
+    complaint_type VARCHAR(100) NOT NULL,
+    descriptor VARCHAR(255) NOT NULL,
+    location_type VARCHAR(100) NOT NULL,
+    row_key BINARY(16) NULL,
+    load_id INT UNSIGNED NULL,
+    PRIMARY KEY (id),
+    UNIQUE INDEX uq_row_key (row_key){index_lines}
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+
+
+def provision(conn, table):
+    cur = conn.cursor()
+    cur.execute(complaints_ddl(table))
+    # an existing table keeps its data; only missing indexes are added
+    existing = secondary_indexes(conn, table)
+    missing = [f"ADD INDEX {name} ({', '.join(cols)})" for name, cols in indexes.items() if name not in existing]
+    retired = [f"DROP INDEX {name}" for name in retired_indexes if name in existing]
+    if missing or retired:
+        cur.execute(f"ALTER TABLE {table} " + ", ".join(retired + missing))
+    cur.execute(rollup_ddl())
+    cur.close()
+    print(f"{table}: {len(indexes) - len(missing)} indexes present, {len(missing)} added, {len(retired)} dropped; "
+          f"{rollup_table} ready")
+
+
+def endpoint_queries():
+    # (endpoint, sql, params) with representative parameters
+    hour_range = "hour BETWEEN %s AND %s"
+    hour_wrap = "(hour >= %s OR hour <= %s)"
+    temp_sql, top_k_sql = test5.temp_sql, test5.top_k_sql
+    return [
+        ("/getHourlyComplaints", test5.HOURLY_SQL, ()),
+        ("/hourlyData", test5.HOUR_BOROUGH_SQL, (8,)),
+        ("/dateRangeData", test5.DATE_RANGE_SQL, ("2024-01-01", "2024-01-31")),
+        ("/dateHourData", test5.DATE_HOUR_SQL.format(hour_condition=hour_range), ("2024-01-01", "2024-01-31", 8, 17)),
+        ("/dateHourData (wrap)", test5.DATE_HOUR_SQL.format(hour_condition=hour_wrap),
+         ("2024-01-01", "2024-01-31", 22, 3)),
+        ("/topComplaintsByTime", top_k_sql(test5.TOP_BY_TIME_SQL, "borough", "borough, complaint_type, cnt"),
+         (0, 5, 3)),
+        ("/complaintsByTempBucket", temp_sql(test5.TEMP_BUCKET_SQL), ()),
+        ("/topComplaintTypesByTemp",
+         top_k_sql(temp_sql(test5.TOP_BY_TEMP_SQL), "bucket", "bucket, complaint_type, cnt"), (20,)),
+        ("/boroughComplaintsByTemp", temp_sql(test5.BOROUGH_TEMP_SQL), ()),
+        ("/complaintsByTempRange", temp_sql(test5.TEMP_RANGE_SQL, hour_clause=hour_range),
+         ("QUEENS", "2024-01-01", "2024-01-31", 8, 17)),
+        ("/complaintsByTempRange (k)",
+         top_k_sql(temp_sql(test5.TEMP_RANGE_SQL, hour_clause=hour_range), "bucket", "bucket, complaint_type, cnt"),
+         ("QUEENS", "2024-01-01", "2024-01-31", 8, 17, 5)),
+    ]
+
+
+def raw_queries(table):
+    # the rollup refresh after an incremental load recounts a date range
+    where = "WHERE date >= %s AND date < %s"
+    return [("rollup refresh", ROLLUP_SELECT_SQL.format(table=table, where=where), ("2024-01-01", "2024-02-01"))]
+
+
+def check_plans(conn, table):
+    # Fails on any plan step that reads a whole table, row by row (type ALL)
+    # or through a full index scan (type index); lookups and range scans are
+    # fine, as is the scan of a top-K query's already grouped <derivedN> result.
+    cur = conn.cursor()
+    for name in (rollup_table, table):
+        cur.execute(f"ANALYZE TABLE {name}")
+        cur.fetchall()
+    failures = []
+    for endpoint, sql, params in endpoint_queries() + raw_queries(table):
+        cur.execute("EXPLAIN " + sql, params)
+        names = [d[0] for d in cur.description]
+        for step in cur.fetchall():
+            step = dict(zip(names, step))
+            print(f"  {endpoint:<28} type={step['type']:<6} key={step['key']}  {step['Extra'] or ''}")
+            if step["type"] in ("ALL", "index") and not (step["table"] or "").startswith("<derived"):
+                failures.append(endpoint)
+    cur.close()
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the complaint tables and indexes, and check endpoint query plans")
+    parser.add_argument("--config", default=config_file)
+    parser.add_argument("--print", action="store_true", help="only print the CREATE TABLE statement")
+    parser.add_argument("--check", action="store_true",
+                        help="EXPLAIN every endpoint query and the rollup refresh; fail on full scans")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    table = config.get('tables', {}).get('complaints', 'nyc_complaints')
+    if args.print:
+        print(complaints_ddl(table) + ";\n")
+        print(rollup_ddl() + ";")
+        sys.exit(0)
+
+    conn = connect(config['db'])
+    try:
+        provision(conn, table)
+        if args.check:
+            failures = check_plans(conn, table)
+            if failures:
+                print(f"Full table or index scan in: {', '.join(failures)}")
+                sys.exit(1)
+            print("No endpoint query or rollup refresh falls back to a full table or index scan")
+    finally:
+        conn.close()
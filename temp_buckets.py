@@ -0,0 +1,46 @@
+import numpy as np
+
+# Temperature buckets shared by the test5.py routes and memory_backend.py.
+# With edges e0 < e1 < ... < en the buckets keep the original routes'
+# CASE: below e0, then [e0, e1], (e1, e2], ..., and above en, so every
+# temperature lands in exactly one bucket and exactly 10 stays in 0-10°C.
+# NULL temperatures are in none. Buckets are numbered in temperature order
+# and reported by label ('< 0°C', '0-10°C', '10-20°C', '> 20°C').
+
+DEFAULT_EDGES = (0, 10, 20)
+
+
+def _fmt(edge):
+    return str(int(edge)) if float(edge).is_integer() else str(edge)
+
+
+class TempBuckets:
+    def __init__(self, edges=DEFAULT_EDGES):
+        self.edges = sorted(float(e) for e in edges)
+        if not self.edges or len(set(self.edges)) != len(self.edges):
+            raise ValueError(f"temperature bucket edges must be distinct and non-empty: {edges}")
+        e = [_fmt(x) for x in self.edges]
+        # with a single edge the top bucket starts at it
+        top = f"> {e[-1]}°C" if len(e) > 1 else f"≥ {e[0]}°C"
+        self.labels = [f"< {e[0]}°C"] + [f"{a}-{b}°C" for a, b in zip(e, e[1:])] + [top]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def sql_case(self, column="temperature_C"):
+        # Bucket number as SQL; the caller filters out NULLs
+        whens = [f"WHEN {column} < {_fmt(self.edges[0])} THEN 0"]
+        whens += [f"WHEN {column} <= {_fmt(e)} THEN {i}" for i, e in enumerate(self.edges[1:], 1)]
+        return f"CASE {' '.join(whens)} ELSE {len(self.edges)} END"
+
+    def digitize(self, temps):
+        # Bucket numbers for a float array; NaN (no temperature) gets -1
+        buckets = np.digitize(temps, self.edges[1:], right=True) + 1
+        return np.where(np.isnan(temps), -1, np.where(temps < self.edges[0], 0, buckets))
+
+    def label_rows(self, rows):
+        # Replaces the numeric 'bucket' of query rows with its 'temp_bucket' label
+        for row in rows:
+            row['temp_bucket'] = self.labels[row.pop('bucket')]
+        return rows
+
@@ -1,7 +1,16 @@
 import requests
 import csv
+import argparse
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from time import sleep
+
+from test2 import clean_row
 
 API_KEY = "123"
 BASE_URL = "https://apps.clarksonmsda.org/getData_by_zip_by_date_all_hours"
@@ -18,30 +27,360 @@ start_date = datetime(2015, 7, 1)
 end_date = datetime(2015, 12, 31)
 
 output_file = "nyc_hourly_weather_2015_H2.csv"
+cache_file = "weather_cache.sqlite"
+weather_cleaned_file = "nyc_weather_cleaned.csv"
+merge_skipped_file = "merge_skipped_keys.csv"
+
+# fetch tuning: requests in flight, token bucket rate (req/sec) and retries
+MAX_IN_FLIGHT = 8
+RATE_PER_SEC = 5.0
+BURST = 5
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+TIMEOUT = 10
+
+
+class TokenBucket:
+    # Replaces the fixed sleep between calls. The rate drops when the API
+    # pushes back (429 / 5xx) and creeps back up to the target on success.
+    def __init__(self, rate, capacity):
+        self.target_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        with self.lock:
+            self.rate = max(self.target_rate / 16, self.rate / 2)
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.target_rate, self.rate * 1.1)
+
+
+class ResponseCache:
+    # Raw API responses keyed by (zipcode, date). Every response is committed
+    # as soon as it arrives, so the cache doubles as the resume checkpoint.
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                zipcode TEXT NOT NULL,
+                date TEXT NOT NULL,
+                body TEXT NOT NULL,
+                fetched_at TEXT NOT NULL,
+                PRIMARY KEY (zipcode, date)
+            )
+        """)
+        self.conn.commit()
+        self.lock = threading.Lock()
+
+    def keys(self):
+        with self.lock:
+            return set(self.conn.execute("SELECT zipcode, date FROM responses"))
+
+    def get(self, zipcode, date_str):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body FROM responses WHERE zipcode = ? AND date = ?", (zipcode, date_str)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, zipcode, date_str, body):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (zipcode, date_str, body, datetime.now().isoformat(timespec="seconds")),
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def daterange(start, end):
+    current = start
+    while current <= end:
+        yield current.strftime("%Y-%m-%d")
+        current += timedelta(days=1)
+
+
+def parse_hours(data):
+    rows = []
+    for hour_dict in data["results"][0]["hour"]:
+        for hour, info in hour_dict.items():
+            rows.append((hour, info["weather"]["air_temperature"]["temperature"]))
+    rows.sort(key=lambda r: int(r[0]))
+    return rows
+
+
+def fetch_day(session, cache, zip_code, date_str, bucket, base_url=BASE_URL):
+    url = f"{base_url}?key={API_KEY}&zipcode={zip_code}&date={date_str}"
+    for attempt in range(MAX_RETRIES + 1):
+        bucket.acquire()
+        try:
+            res = session.get(url, timeout=TIMEOUT)
+            if res.status_code == 200:
+                bucket.speed_up()
+                hours = parse_hours(res.json())
+                cache.put(zip_code, date_str, res.text)
+                return hours
+            if res.status_code == 429 or res.status_code >= 500:
+                bucket.slow_down()
+            error = f"HTTP {res.status_code}"
+        except (requests.Timeout, requests.ConnectionError) as e:
+            bucket.slow_down()
+            error = str(e)
+        if attempt < MAX_RETRIES:
+            time.sleep(BACKOFF_BASE * (2 ** attempt) * (1 + random.random()))
+    raise RuntimeError(f"gave up after {MAX_RETRIES + 1} attempts: {error}")
+
+
+def iter_weather(start, end, base_url=BASE_URL, workers=MAX_IN_FLIGHT, rate=RATE_PER_SEC,
+                 cache_path=cache_file, refresh=False, stats=None):
+    # Yields raw (date, hour, borough, zipcode, temperature) rows in
+    # (date, hour, borough) order; stats gets fetched/cached/failed counts.
+    stats = stats if stats is not None else {}
+    stats.update(fetched=0, cached=0, failed=0)
+    bucket = TokenBucket(rate, BURST)
+    cache = ResponseCache(cache_path)
+    session = make_session(workers)
+    dates = list(daterange(start, end))
+    cached = set() if refresh else cache.keys()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for date_str in dates:
+            for borough, zip_code in borough_zip_map.items():
+                if (zip_code, date_str) not in cached:
+                    futures[(date_str, borough)] = pool.submit(
+                        fetch_day, session, cache, zip_code, date_str, bucket, base_url
+                    )
 
-with open(output_file, "w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow(["date", "hour", "borough", "zipcode", "temperature_C"])
+        # Futures complete in any order; draining them day by day keeps the
+        # output in (date, hour, borough) order.
+        for date_str in dates:
+            by_borough = {}
+            for borough, zip_code in borough_zip_map.items():
+                future = futures.pop((date_str, borough), None)
+                if future is None:
+                    by_borough[borough] = parse_hours(json.loads(cache.get(zip_code, date_str)))
+                    stats["cached"] += 1
+                    continue
+                try:
+                    by_borough[borough] = future.result()
+                    stats["fetched"] += 1
+                except Exception as e:
+                    print(f" Error for {borough} on {date_str}: {e}")
+                    stats["failed"] += 1
 
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.strftime("%Y-%m-%d")
-        for borough, zip_code in borough_zip_map.items():
-            url = f"{BASE_URL}?key={API_KEY}&zipcode={zip_code}&date={date_str}"
+            temps = {}
+            for borough, hours in by_borough.items():
+                for hour, temp in hours:
+                    temps.setdefault(int(hour), []).append((hour, borough, temp))
+            for h in sorted(temps):
+                for hour, borough, temp in temps[h]:
+                    yield [date_str, hour, borough, borough_zip_map[borough], temp]
+            print(f" {date_str}: {len(by_borough)}/{len(borough_zip_map)} boroughs")
+
+    session.close()
+    cache.close()
+
+
+def fetch_range(start, end, out_path, base_url=BASE_URL, workers=MAX_IN_FLIGHT, rate=RATE_PER_SEC,
+                cache_path=cache_file, refresh=False):
+    stats = {}
+    # Write to a temp file and swap it in at the end, so a crash never leaves
+    # a truncated output behind; everything fetched so far is in the cache.
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["date", "hour", "borough", "zipcode", "temperature_C"])
+        writer.writerows(iter_weather(start, end, base_url, workers, rate, cache_path, refresh, stats))
+    os.replace(tmp_path, out_path)
+
+    print(f"Fetched: {stats['fetched']}, from cache: {stats['cached']}, failed: {stats['failed']}")
+    return stats["fetched"], stats["failed"]
+
+
+def index_weather(path):
+    # Rows of the cleaned file plus the set of (date, hour, BOROUGH) cells that
+    # already have a temperature. Rows with a blank temperature count as gaps.
+    rows = []
+    present = set()
+    if not os.path.exists(path):
+        return ["date", "hour", "borough", "zipcode", "temperature_C"], rows, present
+    with open(path, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for row in reader:
+            rows.append(row)
+            if row[4] != "":
+                present.add((row[0], int(row[1]), row[2].strip().upper()))
+    return header, rows, present
+
+
+def read_skipped_keys(path):
+    keys = set()
+    if os.path.exists(path):
+        with open(path, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                keys.add((row["date"], int(row["hour"]), row["borough"]))
+    return keys
+
+
+def find_gaps(present, dates, extra_keys=()):
+    boroughs = [b.upper() for b in borough_zip_map]
+    gaps = {(d, h, b) for d in dates for h in range(24) for b in boroughs if (d, h, b) not in present}
+    gaps |= {k for k in extra_keys if k[2] in boroughs and k not in present}
+    return gaps
+
+
+def gap_rows(date_str, borough, hours, gaps):
+    # Cleaned rows for the gap cells of one borough-day
+    rows = []
+    for hour, temp in hours:
+        if (date_str, int(hour), borough.upper()) in gaps:
+            row, ok = clean_row([date_str, hour, borough, borough_zip_map[borough], temp])
+            if ok:
+                rows.append(row)
+    return rows
+
+
+def sync(weather_path, skipped_path, start=None, end=None, base_url=BASE_URL, workers=MAX_IN_FLIGHT,
+         rate=RATE_PER_SEC, cache_path=cache_file, refresh=False):
+    header, rows, present = index_weather(weather_path)
+
+    # Expected coverage: every day the file already spans, the requested range
+    # and anything the merge step could not find weather for.
+    dates = set()
+    known = sorted({row[0] for row in rows})
+    if known:
+        dates.update(daterange(datetime.strptime(known[0], "%Y-%m-%d"), datetime.strptime(known[-1], "%Y-%m-%d")))
+    if start and end:
+        dates.update(daterange(start, end))
+    gaps = find_gaps(present, dates, read_skipped_keys(skipped_path))
+    print(f"Missing cells: {len(gaps)}")
+    if not gaps:
+        return 0
+
+    names = {b.upper(): b for b in borough_zip_map}
+    wanted = {}
+    for d, _, b in gaps:
+        wanted[(d, names[b])] = wanted.get((d, names[b]), 0) + 1
+    days = sorted(wanted)
+    print(f"Days to fetch: {len(days)}")
+
+    bucket = TokenBucket(rate, BURST)
+    cache = ResponseCache(cache_path)
+    session = make_session(workers)
+    cached = set() if refresh else cache.keys()
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for date_str, borough in days:
+            zip_code = borough_zip_map[borough]
+            if (zip_code, date_str) in cached:
+                hours = parse_hours(json.loads(cache.get(zip_code, date_str)))
+                results[(date_str, borough)] = gap_rows(date_str, borough, hours, gaps)
+                if len(results[(date_str, borough)]) == wanted[(date_str, borough)]:
+                    continue
+            # A cached response that leaves cells blank is where the gap came
+            # from, so ask the API again; fetch_day replaces the cache entry.
+            futures[(date_str, borough)] = pool.submit(
+                fetch_day, session, cache, zip_code, date_str, bucket, base_url
+            )
+        print(f"From cache: {len(days) - len(futures)}, refetching: {len(futures)}")
+        for key, future in futures.items():
             try:
-                res = requests.get(url)
-                if res.status_code == 200:
-                    data = res.json()
-                    hour_data = data["results"][0]["hour"]
-                    for hour_dict in hour_data:
-                        for hour, info in hour_dict.items():
-                            temp = info["weather"]["air_temperature"]["temperature"]
-                            writer.writerow([date_str, hour, borough, zip_code, temp])
-                    print(f" {borough} on {date_str}")
-                else:
-                    print(f" Failed for {borough} on {date_str}: {res.status_code}")
+                results[key] = gap_rows(*key, future.result(), gaps)
             except Exception as e:
-                print(f" Error for {borough} on {date_str}: {e}")
-            sleep(0.3)  
+                # keep whatever the cached response did fill
+                print(f" Error for {key[1]} on {key[0]}: {e}")
+    session.close()
+    cache.close()
+
+    new_rows = [row for day_rows in results.values() for row in day_rows]
+
+    filled = {(r[0], int(r[1]), r[2].upper()) for r in new_rows}
+    rows = [r for r in rows if (r[0], int(r[1]), r[2].strip().upper()) not in filled] + new_rows
+    order = {b.upper(): i for i, b in enumerate(borough_zip_map)}
+    rows.sort(key=lambda r: (r[0], int(r[1]), order.get(r[2].strip().upper(), len(order))))
+
+    tmp_path = weather_path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(tmp_path, weather_path)
+
+    print(f"Filled {len(filled)} of {len(gaps)} missing cells in {weather_path}")
+    return len(filled)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill hourly NYC weather by borough")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--output", default=output_file)
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--workers", type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument("--rate", type=float, default=RATE_PER_SEC)
+    parser.add_argument("--cache", default=cache_file)
+    parser.add_argument("--refresh", action="store_true", help="ignore cached responses and refetch")
+    parser.add_argument("--sync", action="store_true", help="fill gaps in the cleaned weather file in place")
+    parser.add_argument("--weather", default=weather_cleaned_file)
+    parser.add_argument("--skipped-keys", default=merge_skipped_file)
+    args = parser.parse_args()
+
+    start = datetime.strptime(args.start, "%Y-%m-%d") if args.start else None
+    end = datetime.strptime(args.end, "%Y-%m-%d") if args.end else None
 
-        current_date += timedelta(days=1)
+    t0 = time.time()
+    if args.sync:
+        sync(
+            args.weather,
+            args.skipped_keys,
+            start,
+            end,
+            base_url=args.base_url,
+            workers=args.workers,
+            rate=args.rate,
+            cache_path=args.cache,
+            refresh=args.refresh,
+        )
+    else:
+        fetch_range(
+            start or start_date,
+            end or end_date,
+            args.output,
+            base_url=args.base_url,
+            workers=args.workers,
+            rate=args.rate,
+            cache_path=args.cache,
+            refresh=args.refresh,
+        )
+    print(f"Done in {round(time.time() - t0, 2)}s")
@@ -1,59 +1,337 @@
 import csv
-from datetime import datetime
+import argparse
+import os
+import shutil
+import time
+from datetime import date, datetime
+from multiprocessing import Pool
+
+from merged_store import ColumnarWriter, columnar_dir, convert_csv
+from weather_index import BOROUGH_IDS, HOUR_STRS, WeatherIndex, load_index
 
 weather_file = "nyc_weather_cleaned.csv"
 complaints_file = "311_Service_Requests_from_2010_to_Present.csv"
 output_file = "merged_complaints_weather.csv"
+skipped_keys_file = "merge_skipped_keys.csv"
+
+CHUNK_SCAN_BLOCK = 1 << 24
+
+complaint_columns = ["Created Date", "Borough", "Complaint Type", "Descriptor", "Location Type"]
+fieldnames = ["date", "hour", "borough", "temperature_C", "complaint_type", "descriptor", "location_type"]
+
+
+created_date_format = "%m/%d/%Y %I:%M:%S %p"
+
+_HOURS_12 = {}
+for _h in range(1, 13):
+    _HOURS_12[(f"{_h:02d}", "AM")] = _h % 12
+    _HOURS_12[(f"{_h:02d}", "PM")] = _h % 12 + 12
+_MIN_SEC = frozenset(f"{_n:02d}" for _n in range(60))
+
 
-weather_data = {}
-with open(weather_file, "r") as wf:
-    reader = csv.DictReader(wf)
-    for row in reader:
-        date = row["date"]
-        hour = row["hour"]
-        borough = row["borough"].strip().upper()
-        key = (date, hour, borough)
-        weather_data[key] = row["temperature_C"]
-
-merged_count = 0
-skipped_count = 0
-
-with open(complaints_file, "r") as cf, open(output_file, "w", newline="") as outf:
-    reader = csv.DictReader(cf)
-    fieldnames = ["date", "hour", "borough", "temperature_C", "complaint_type", "descriptor", "location_type"]
-    writer = csv.DictWriter(outf, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for row in reader:
+class CreatedDateDecoder:
+    # Decodes "MM/DD/YYYY HH:MM:SS AM" into (day offset, hour) by slicing.
+    # Every 311 row in a year shares ~365 date prefixes, so the date part is
+    # converted once per distinct prefix. Values that don't fit the fixed
+    # layout go through strptime; rejects are counted by reason.
+    def __init__(self, base_ordinal):
+        self.base_ordinal = base_ordinal
+        self.days = {}
+        self.date_strs = {}
+        self.rejects = {}
+
+    def decode(self, raw):
+        if (len(raw) == 22 and raw[2] == "/" and raw[5] == "/" and raw[10] == " " and raw[13] == ":"
+                and raw[16] == ":" and raw[19] == " "):
+            day = self.days.get(raw[:10], False)
+            if day is False:
+                day = self.days[raw[:10]] = self._day(raw[:10])
+            if day is None:
+                return self._reject("bad date")
+            hour = _HOURS_12.get((raw[11:13], raw[20:]))
+            if hour is not None and raw[14:16] in _MIN_SEC and raw[17:19] in _MIN_SEC:
+                return day, hour
+            return self._fallback(raw, "bad time")
+        return self._fallback(raw, "bad format")
+
+    def _day(self, prefix):
+        digits = prefix[:2] + prefix[3:5] + prefix[6:]
+        if not (digits.isascii() and digits.isdigit()):
+            return None
+        try:
+            return date(int(prefix[6:]), int(prefix[:2]), int(prefix[3:5])).toordinal() - self.base_ordinal
+        except ValueError:
+            return None
+
+    def _fallback(self, raw, reason):
+        if not raw or not raw.strip():
+            return self._reject("empty")
         try:
-            raw_date = row["Created Date"]
-            borough = row["Borough"].strip().upper()
-            complaint = row["Complaint Type"]
-            descriptor = row["Descriptor"]
-            location = row["Location Type"]
-
-            dt = datetime.strptime(raw_date, "%m/%d/%Y %I:%M:%S %p")
-            date = dt.strftime("%Y-%m-%d")
-            hour = str(dt.hour)
-
-            key = (date, hour, borough)
-
-            if key in weather_data:
-                writer.writerow({
-                    "date": date,
-                    "hour": hour,
-                    "borough": borough,
-                    "temperature_C": weather_data[key],
-                    "complaint_type": complaint,
-                    "descriptor": descriptor,
-                    "location_type": location
-                })
-                merged_count += 1
-            else:
-                skipped_count += 1
-
-        except Exception:
-            skipped_count += 1
-
-print(f"Merged: {merged_count} rows")
-print(f"Skipped: {skipped_count} rows (no temperature found or parse error)")
+            dt = datetime.strptime(raw, created_date_format)
+        except ValueError:
+            return self._reject(reason)
+        return dt.toordinal() - self.base_ordinal, dt.hour
+
+    def _reject(self, reason):
+        self.rejects[reason] = self.rejects.get(reason, 0) + 1
+        return None
+
+    def date_str(self, day):
+        text = self.date_strs.get(day)
+        if text is None:
+            text = self.date_strs[day] = date.fromordinal(self.base_ordinal + day).strftime("%Y-%m-%d")
+        return text
+
+
+def project_columns(lines, header, columns):
+    # Yields tuples of just `columns` from raw CSV lines (None for records
+    # too short to have them, or cut off inside quotes at the end of a
+    # truncated file). Lines whose needed prefix has no quotes are cut
+    # with str.split(maxsplit), so the trailing columns are never parsed;
+    # anything quoted before the cut goes through csv. Quote parity decides
+    # when a record continues on the next line.
+    positions = [header.index(c) for c in columns]
+    last = max(positions)
+    lines = iter(lines)
+    pending = []
+    reader = csv.reader(iter(pending.pop, None))
+    for line in lines:
+        if line == "\n" or line == "\r\n":
+            continue
+        parts = line.split(",", last + 1)
+        cut = len(line) - len(parts[-1]) if len(parts) > last + 1 else len(line)
+        quote = line.find('"')
+        if -1 < quote < cut:
+            record = line
+            if record.count('"') % 2:
+                for more in lines:
+                    record += more
+                    if record.count('"') % 2 == 0:
+                        break
+                else:
+                    yield None
+                    continue
+            pending.append(record)
+            parts = next(reader)
+        else:
+            if len(parts) > last + 1 and parts[-1].count('"') % 2:
+                tail = parts[-1]
+                for more in lines:
+                    tail += more
+                    if tail.count('"') % 2 == 0:
+                        break
+                else:
+                    yield None
+                    continue
+            if len(parts) == last + 1:
+                parts[last] = parts[last].rstrip("\r\n")
+        yield tuple(parts[i] for i in positions) if len(parts) > last else None
+
+
+def read_complaints(lines):
+    # Projects a 311 export (header line first) down to complaint_columns
+    lines = iter(lines)
+    header = next(csv.reader([next(lines)]))
+    return project_columns(lines, header, complaint_columns)
+
+
+def index_weather(rows):
+    # rows are cleaned weather rows: (date, hour, borough, zipcode, temperature_C)
+    return WeatherIndex.from_rows(rows)
+
+
+def load_weather(path):
+    # weather_index.npz (see weather_index.py) or the cleaned weather CSV
+    return load_index(path)
+
+
+def merge_complaints(rows, weather, stats):
+    # rows are complaint_columns tuples (see read_complaints). Yields output
+    # rows in fieldnames order; stats collects merged/skipped counts and the
+    # (date, hour, borough) keys with no weather.
+    missing_keys = stats.setdefault("missing_keys", {})
+    rejects = stats.setdefault("rejects", {})
+    decoder = CreatedDateDecoder(weather.base_ordinal)
+    date_strs = weather.date_strs
+    days = weather.days
+    for row in rows:
+        if row is None:
+            rejects["missing column"] = rejects.get("missing column", 0) + 1
+            stats["skipped"] += 1
+            continue
+        raw_date, borough, complaint, descriptor, location = row
+        borough = borough.strip().upper()
+
+        decoded = decoder.decode(raw_date)
+        if decoded is None:
+            stats["skipped"] += 1
+            continue
+        day, hour = decoded
+        borough_id = BOROUGH_IDS.get(borough)
+
+        temp = None
+        if 0 <= day < days and borough_id is not None:
+            temp = weather.lookup(day, hour, borough_id)
+
+        if temp is not None:
+            yield [date_strs[day], HOUR_STRS[hour], borough, temp, complaint, descriptor, location]
+            stats["merged"] += 1
+        else:
+            key = (decoder.date_str(day), HOUR_STRS[hour], borough)
+            missing_keys[key] = missing_keys.get(key, 0) + 1
+            stats["skipped"] += 1
+
+    for reason, count in decoder.rejects.items():
+        rejects[reason] = rejects.get(reason, 0) + count
+
+
+def chunk_ranges(path, n_chunks, start=None):
+    # Byte ranges [start, end) over the data rows, each ending on a record
+    # boundary. A newline ends a record only when it sits outside quotes,
+    # i.e. when the count of '"' before it is even (escaped "" counts twice),
+    # so one pass of bytes.count over the file places every cut exactly.
+    # start defaults to just past the header and must be a record boundary.
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if start is None:
+            start = len(f.readline())
+        f.seek(start)
+        step = max(1, (size - start) // n_chunks)
+        bounds = [start]
+        target = start + step
+        quotes = 0
+        pos = start
+        while len(bounds) < n_chunks:
+            block = f.read(CHUNK_SCAN_BLOCK)
+            if not block:
+                break
+            i = 0
+            while len(bounds) < n_chunks and i < len(block):
+                if pos + i < target:
+                    j = min(len(block), target - pos)
+                    quotes += block.count(b'"', i, j)
+                    i = j
+                    continue
+                nl = block.find(b"\n", i)
+                if nl == -1:
+                    quotes += block.count(b'"', i)
+                    break
+                quotes += block.count(b'"', i, nl)
+                i = nl + 1
+                if quotes % 2 == 0:
+                    bounds.append(pos + i)
+                    target = max(pos + i, start + step * len(bounds))
+            pos += len(block)
+    bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def read_header(path):
+    with open(path, "r", newline="") as f:
+        return next(csv.reader(f))
+
+
+def iter_range_lines(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            pos += len(line)
+            yield line.decode("utf-8")
+            if pos >= end:
+                break
+
+
+_worker_weather = None
+
+
+def _init_worker(weather):
+    global _worker_weather
+    _worker_weather = weather
+
+
+def _merge_chunk(args):
+    path, header, start, end, part_path = args
+    stats = {"merged": 0, "skipped": 0, "missing_keys": {}, "rejects": {}}
+    rows = project_columns(iter_range_lines(path, start, end), header, complaint_columns)
+    with open(part_path, "w", newline="") as outf:
+        csv.writer(outf).writerows(merge_complaints(rows, _worker_weather, stats))
+    return stats
+
+
+def parallel_merge(complaints_path, out_path, weather, workers):
+    # Each worker joins one byte range against the weather index (inherited
+    # copy-on-write under fork) into its own part file; the parts are then
+    # appended in file order so the output matches the single-process merge.
+    header = read_header(complaints_path)
+    ranges = chunk_ranges(complaints_path, workers * 4)
+    tasks = [(complaints_path, header, a, b, f"{out_path}.part{i:04d}") for i, (a, b) in enumerate(ranges)]
+
+    totals = {"merged": 0, "skipped": 0, "missing_keys": {}, "rejects": {}}
+    with Pool(workers, initializer=_init_worker, initargs=(weather,)) as pool:
+        for stats in pool.imap(_merge_chunk, tasks):
+            totals["merged"] += stats["merged"]
+            totals["skipped"] += stats["skipped"]
+            for key, count in stats["missing_keys"].items():
+                totals["missing_keys"][key] = totals["missing_keys"].get(key, 0) + count
+            for reason, count in stats["rejects"].items():
+                totals["rejects"][reason] = totals["rejects"].get(reason, 0) + count
+
+    with open(out_path, "w", newline="") as outf:
+        csv.writer(outf).writerow(fieldnames)
+        for task in tasks:
+            with open(task[-1], "r", newline="") as part:
+                shutil.copyfileobj(part, outf)
+            os.remove(task[-1])
+    return totals
+
+
+def write_skipped_keys(path, missing_keys):
+    # (date, hour, borough) cells with no weather; test1.py --sync refetches them
+    with open(path, "w", newline="") as kf:
+        writer = csv.writer(kf)
+        writer.writerow(["date", "hour", "borough", "complaints"])
+        for key in sorted(missing_keys):
+            writer.writerow([*key, missing_keys[key]])
+
+
+def print_stats(stats):
+    print(f"Merged: {stats['merged']} rows")
+    print(f"Skipped: {stats['skipped']} rows (no temperature found or parse error)")
+    for reason, count in sorted(stats.get("rejects", {}).items()):
+        print(f"  rejected ({reason}): {count}")
+    print(f"Missing weather cells: {len(stats['missing_keys'])} (saved to {skipped_keys_file})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge 311 complaints with hourly weather")
+    parser.add_argument("--weather", default=weather_file)
+    parser.add_argument("--complaints", default=complaints_file)
+    parser.add_argument("--output", default=output_file)
+    parser.add_argument("--workers", type=int, default=1, help="merge byte ranges of the 311 file in N processes")
+    parser.add_argument("--format", choices=["csv", "columnar"], default="csv",
+                        help="columnar also writes the dictionary-encoded store (see merged_store.py)")
+    parser.add_argument("--columnar-output", default=columnar_dir)
+    args = parser.parse_args()
+
+    t0 = time.time()
+    weather = load_weather(args.weather)
+
+    if args.workers > 1:
+        stats = parallel_merge(args.complaints, args.output, weather, args.workers)
+        if args.format == "columnar":
+            convert_csv(args.output, args.columnar_output)
+    elif args.format == "columnar":
+        stats = {"merged": 0, "skipped": 0, "missing_keys": {}, "rejects": {}}
+        with open(args.complaints, "r") as cf, ColumnarWriter(args.columnar_output) as writer:
+            writer.writerows(merge_complaints(read_complaints(cf), weather, stats))
+    else:
+        stats = {"merged": 0, "skipped": 0, "missing_keys": {}, "rejects": {}}
+        with open(args.complaints, "r") as cf, open(args.output, "w", newline="") as outf:
+            writer = csv.writer(outf)
+            writer.writerow(fieldnames)
+            writer.writerows(merge_complaints(read_complaints(cf), weather, stats))
+
+    write_skipped_keys(skipped_keys_file, stats["missing_keys"])
+    print_stats(stats)
+    print(f"Done in {round(time.time() - t0, 2)}s")
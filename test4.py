@@ -1,42 +1,538 @@
 # %%
-import pymysql, csv, yaml
-
-with open("config.yaml", 'r') as file:
-    config = yaml.safe_load(file)
-
-db_config = config['db']
-
-conn = pymysql.connect(
-    host=db_config['host'],
-    port=db_config['port'],
-    user=db_config['user'],
-    passwd=db_config['passwd'],
-    db=db_config['db'],
-    autocommit=True
-)
-cur = conn.cursor()
-
-with open("merged_complaints_weather.csv", encoding='utf-8') as f:
-    reader = csv.DictReader(f)
-    rows = []
-    for row in reader:
-        rows.append((
-            row['date'],
-            int(row['hour']),
-            row['borough'],
-            float(row['temperature_C']) if row['temperature_C'] else None,
-            row['complaint_type'],
-            row['descriptor'],
-            row['location_type']
-        ))
-
-insert_query = '''
-INSERT INTO nyc_complaints (date, hour, borough, temperature_C, complaint_type, descriptor, location_type)
-VALUES (%s, %s, %s, %s, %s, %s, %s);
-'''
-
-cur.executemany(insert_query, rows)
-print(f"Inserted {len(rows)} rows.")
+import pymysql, yaml
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from merge_partitions import file_checksum, load_manifest
+from merged_store import read_merged
 
+# merged_complaints_weather.csv, the columnar store from test3.py --format columnar,
+# or the month partitions from merge_partitions.py
+merged_file = "merged_complaints_weather.csv"
+config_file = "config.yaml"
+deferred_indexes_file = "deferred_indexes.json"
 
+BATCH_SIZE = 5000
+columns = ["date", "hour", "borough", "temperature_C", "complaint_type", "descriptor", "location_type"]
+# Incremental loads key rows on everything but the temperature, plus a count
+# for identical complaints, so a weather change updates rows in place
+key_columns = ["date", "hour", "borough", "complaint_type", "descriptor", "location_type"]
+state_table = "load_state"
+# Complaint counts per (date, hour, borough, complaint_type), which is what
+# every test5.py endpoint aggregates. temperature_C rides along: the merge
+# looks it up by (date, hour, borough), so it is a single value per key and
+# any temperature bucketing can be applied to the rollup.
+rollup_table = "complaint_rollup"
+# Bumped after every load with the first date whose counts changed (NULL
+# for all); test5.py drops its result cache and updates its in-memory
+# backend from that date when it changes
+version_table = "data_version"
 
+
+def load_config(path=config_file):
+    with open(path, 'r') as file:
+        return yaml.safe_load(file)
+
+
+def connect(db_config, **kwargs):
+    return pymysql.connect(
+        host=db_config['host'],
+        port=db_config['port'],
+        user=db_config['user'],
+        passwd=db_config['passwd'],
+        db=db_config['db'],
+        autocommit=True,
+        **kwargs
+    )
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def insert_values(cur, table, batch):
+    # pymysql rewrites executemany on an INSERT ... VALUES into multi-row
+    # VALUES statements (capped at max_stmt_length), one round trip each
+    cur.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+        batch,
+    )
+
+
+def tsv_field(value):
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def insert_infile(cur, table, batch):
+    # One LOAD DATA LOCAL INFILE per batch from a temp TSV; needs
+    # local_infile enabled on both the connection and the server
+    with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False, encoding="utf-8", newline="") as f:
+        for row in batch:
+            f.write("\t".join(tsv_field(v) for v in row))
+            f.write("\n")
+        path = f.name
+    try:
+        cur.execute(
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+            f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({', '.join(columns)})",
+            (path,),
+        )
+    finally:
+        os.remove(path)
+
+
+def load(conn, table, rows, batch_size=BATCH_SIZE, method="values", resume_from=0, progress_every=5.0):
+    # Streams rows into the table batch by batch, so memory stays at one
+    # batch whatever the file size. A failed batch stops the load and reports
+    # the row offset to pass back as resume_from.
+    insert = insert_infile if method == "infile" else insert_values
+    cur = conn.cursor()
+    loaded = 0
+    t0 = last = time.time()
+    try:
+        for batch in batches(itertools.islice(rows, resume_from, None), batch_size):
+            try:
+                insert(cur, table, batch)
+            except Exception as e:
+                raise RuntimeError(f"batch at row {resume_from + loaded} failed ({e}); "
+                                   f"rerun with --resume-from {resume_from + loaded}") from e
+            loaded += len(batch)
+            now = time.time()
+            if now - last >= progress_every:
+                print(f"  {resume_from + loaded} rows ({int(loaded / (now - t0))} rows/sec)")
+                last = now
+    finally:
+        cur.close()
+    elapsed = time.time() - t0
+    print(f"Inserted {loaded} rows in {round(elapsed, 2)}s ({int(loaded / max(elapsed, 1e-9))} rows/sec)")
+    return loaded
+
+
+def secondary_indexes(conn, table):
+    # {index name: ADD INDEX clause} for every non-primary index on table
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME, SUB_PART, INDEX_TYPE
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME <> 'PRIMARY'
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    parts = {}
+    for name, non_unique, column, sub_part, index_type in cur.fetchall():
+        kind = "UNIQUE INDEX" if not non_unique else "FULLTEXT INDEX" if index_type == "FULLTEXT" else "INDEX"
+        entry = parts.setdefault(name, (kind, []))
+        entry[1].append(f"`{column}`({sub_part})" if sub_part else f"`{column}`")
+    cur.close()
+    return {name: f"ADD {kind} `{name}` ({', '.join(cols)})" for name, (kind, cols) in parts.items()}
+
+
+def drop_indexes(conn, table, path=deferred_indexes_file):
+    # The definitions are written out first so an interrupted load can put
+    # them back with --restore-indexes
+    indexes = secondary_indexes(conn, table)
+    if not indexes:
+        return {}
+    with open(path, "w") as f:
+        json.dump({"table": table, "indexes": indexes}, f, indent=1)
+    cur = conn.cursor()
+    cur.execute(f"ALTER TABLE {table} " + ", ".join(f"DROP INDEX `{name}`" for name in indexes))
+    cur.close()
+    print(f"Dropped {len(indexes)} secondary indexes: {', '.join(indexes)}")
+    return indexes
+
+
+def restore_indexes(conn, path=deferred_indexes_file):
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        saved = json.load(f)
+    existing = secondary_indexes(conn, saved["table"])
+    missing = [clause for name, clause in saved["indexes"].items() if name not in existing]
+    if missing:
+        # one ALTER so the table is scanned once for all indexes
+        t0 = time.time()
+        cur = conn.cursor()
+        cur.execute(f"ALTER TABLE {saved['table']} " + ", ".join(missing))
+        cur.close()
+        print(f"Rebuilt {len(missing)} indexes in {round(time.time() - t0, 2)}s")
+    os.remove(path)
+
+
+def count_rows(conn, table):
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM {table}")
+    (count,) = cur.fetchone()
+    cur.close()
+    return count
+
+
+def parallel_load(db_config, table, rows, workers, batch_size=BATCH_SIZE, method="values", progress_every=5.0):
+    # Fans batches out over one connection per worker thread. At most
+    # 2 x workers batches are in flight, so memory stays bounded.
+    insert = insert_infile if method == "infile" else insert_values
+    local = threading.local()
+    connections = []
+    lock = threading.Lock()
+
+    def worker_insert(batch):
+        if not hasattr(local, "conn"):
+            local.conn = connect(db_config, local_infile=method == "infile")
+            cur = local.conn.cursor()
+            cur.execute("SET SESSION unique_checks = 0, foreign_key_checks = 0")
+            cur.close()
+            with lock:
+                connections.append(local.conn)
+        cur = local.conn.cursor()
+        try:
+            insert(cur, table, batch)
+        finally:
+            cur.close()
+        return len(batch)
+
+    slots = threading.Semaphore(workers * 2)
+    source = 0
+    loaded = 0
+    t0 = last = time.time()
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch in batches(rows, batch_size):
+                slots.acquire()
+                source += len(batch)
+                future = pool.submit(worker_insert, batch)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+
+                done = [f for f in futures if f.done()]
+                futures = [f for f in futures if not f.done()]
+                for f in done:
+                    loaded += f.result()
+                now = time.time()
+                if now - last >= progress_every:
+                    print(f"  {loaded} rows ({int(loaded / (now - t0))} rows/sec)")
+                    last = now
+            for f in futures:
+                loaded += f.result()
+    finally:
+        for c in connections:
+            c.close()
+    elapsed = time.time() - t0
+    print(f"Inserted {loaded} rows with {workers} connections in {round(elapsed, 2)}s "
+          f"({int(loaded / max(elapsed, 1e-9))} rows/sec)")
+    return source, loaded
+
+
+def ensure_incremental_schema(conn, table):
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {state_table} (
+            target VARCHAR(64) NOT NULL,
+            part VARCHAR(16) NOT NULL,
+            checksum CHAR(32) NULL,
+            high_water DATE NULL,
+            row_count INT UNSIGNED NOT NULL,
+            loaded_at DATETIME NOT NULL,
+            PRIMARY KEY (target, part)
+        )
+    """)
+    cur.execute("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME IN ('row_key', 'load_id')
+    """, (table,))
+    present = {name for (name,) in cur.fetchall()}
+    if "row_key" not in present:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN row_key BINARY(16) NULL, ADD UNIQUE INDEX uq_row_key (row_key)")
+    if "load_id" not in present:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN load_id INT UNSIGNED NULL")
+    cur.close()
+
+
+def load_state(conn, table):
+    cur = conn.cursor()
+    cur.execute(f"SELECT part, checksum, high_water FROM {state_table} WHERE target = %s", (table,))
+    state = {part: (checksum, high_water) for part, checksum, high_water in cur.fetchall()}
+    cur.close()
+    return state
+
+
+def keyed_rows(rows, load_id):
+    # Appends (row_key, load_id). Identical complaints are told apart by
+    # their occurrence number, which is stable while the unit is unchanged.
+    seen = {}
+    for row in rows:
+        natural = (row[0], row[1], row[2], row[4], row[5], row[6])
+        n = seen.get(natural, 0)
+        seen[natural] = n + 1
+        key = hashlib.blake2b("\x1f".join(map(str, (*natural, n))).encode(), digest_size=16).digest()
+        yield (*row, key, load_id)
+
+
+def upsert_values(cur, table, batch):
+    cur.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}, row_key, load_id) "
+        f"VALUES ({', '.join(['%s'] * (len(columns) + 2))}) "
+        f"ON DUPLICATE KEY UPDATE temperature_C = VALUES(temperature_C), load_id = VALUES(load_id)",
+        batch,
+    )
+
+
+def upsert_unit(conn, table, rows, load_id, stale_where, stale_args, state, batch_size=BATCH_SIZE, forget=False):
+    # One transaction per unit (a month partition, or everything from the
+    # high-water date on): upsert its rows, delete the rows of the same date
+    # range this load did not touch, and record state() once the rows are in.
+    # forget drops the unit's state row instead, for a month that is gone.
+    cur = conn.cursor()
+    count = 0
+    conn.begin()
+    try:
+        for batch in batches(keyed_rows(rows, load_id), batch_size):
+            upsert_values(cur, table, batch)
+            count += len(batch)
+        cur.execute(f"DELETE FROM {table} WHERE {stale_where} AND (load_id IS NULL OR load_id <> %s)",
+                    (*stale_args, load_id))
+        removed = cur.rowcount
+        if forget:
+            cur.execute(f"DELETE FROM {state_table} WHERE target = %s AND part = %s", (table, state()[0]))
+        else:
+            cur.execute(
+                f"REPLACE INTO {state_table} (target, part, checksum, high_water, row_count, loaded_at) "
+                f"VALUES (%s, %s, %s, %s, %s, NOW())",
+                (table, *state(), count),
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return count, removed
+
+
+def incremental_load(conn, table, path, batch_size=BATCH_SIZE):
+    # Month partitions are compared by file checksum and only changed ones
+    # are reloaded; a single CSV or columnar store reloads from the last
+    # high-water date (which may have been partial) onwards.
+    ensure_incremental_schema(conn, table)
+    state = load_state(conn, table)
+    load_id = int(time.time())
+    upserted = removed = 0
+    spans = []
+    t0 = time.time()
+
+    manifest = load_manifest(path) if os.path.isdir(path) else {}
+    if manifest:
+        partitions = manifest["partitions"]
+        changed = []
+        for month in sorted(partitions):
+            part_path = os.path.join(path, partitions[month]["file"])
+            checksum = file_checksum(part_path, 0, os.path.getsize(part_path))
+            if state.get(month, (None,))[0] != checksum:
+                changed.append((month, part_path, checksum))
+        # months that dropped out of the partitions entirely
+        for month in sorted(set(state) - set(partitions) - {"*"}):
+            changed.append((month, None, None))
+        for month, part_path, checksum in changed:
+            year, mon = int(month[:4]), int(month[5:7])
+            first = f"{month}-01"
+            after = f"{year + mon // 12:04d}-{mon % 12 + 1:02d}-01"
+            rows = read_merged(part_path) if part_path else ()
+            n, gone = upsert_unit(conn, table, rows, load_id, "date >= %s AND date < %s", (first, after),
+                                  lambda: (month, checksum, None), batch_size, forget=part_path is None)
+            upserted += n
+            removed += gone
+            spans.append((first, after))
+            print(f"  {month}: {n} rows upserted, {gone} stale rows removed")
+        print(f"Partitions: {len(partitions)} total, {len(changed)} reloaded")
+    else:
+        high_water = state.get("*", (None, None))[1]
+        since = high_water.strftime("%Y-%m-%d") if high_water else ""
+        last = [since]
+
+        def tail(rows):
+            for row in rows:
+                if row[0] >= since:
+                    if row[0] > last[0]:
+                        last[0] = row[0]
+                    yield row
+
+        upserted, removed = upsert_unit(conn, table, tail(read_merged(path)), load_id,
+                                        "date >= %s", (since or "0001-01-01",),
+                                        lambda: ("*", None, last[0] or None), batch_size)
+        print(f"From {since or 'the beginning'}: {upserted} rows upserted, {removed} stale rows removed")
+        spans.append((since or None, None))
+
+    elapsed = time.time() - t0
+    print(f"Incremental load done in {round(elapsed, 2)}s")
+    return upserted, removed, spans
+
+
+def rollup_ddl(table=rollup_table):
+    return f"""CREATE TABLE IF NOT EXISTS {table} (
+    date DATE NOT NULL,
+    hour TINYINT UNSIGNED NOT NULL,
+    borough VARCHAR(16) NOT NULL,
+    complaint_type VARCHAR(100) NOT NULL,
+    temperature_C FLOAT NULL,
+    cnt INT UNSIGNED NOT NULL,
+    PRIMARY KEY (date, hour, borough, complaint_type),
+    INDEX idx_rollup_hour (hour, borough, complaint_type, cnt),
+    INDEX idx_rollup_temp (temperature_C, borough, complaint_type, cnt),
+    INDEX idx_rollup_borough_date (borough, date, hour, temperature_C, complaint_type, cnt)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+
+
+# Recount of the rollup keys from the raw table; schema.py EXPLAINs it
+# against the raw table's date index
+ROLLUP_SELECT_SQL = """
+            SELECT date, hour, borough, complaint_type, MAX(temperature_C), COUNT(*)
+            FROM {table} {where}
+            GROUP BY date, hour, borough, complaint_type
+        """
+
+
+def refresh_rollup(conn, table, since=None, until=None):
+    # Recounts the rollup for dates in [since, until) from the raw table
+    # (open-ended when None) in one transaction, so readers never see a
+    # half-built range.
+    where, params = [], []
+    if since:
+        where.append("date >= %s")
+        params.append(since)
+    if until:
+        where.append("date < %s")
+        params.append(until)
+    where = f"WHERE {' AND '.join(where)}" if where else ""
+    t0 = time.time()
+    cur = conn.cursor()
+    cur.execute(rollup_ddl())
+    conn.begin()
+    try:
+        cur.execute(f"DELETE FROM {rollup_table} {where}", params)
+        cur.execute(f"INSERT INTO {rollup_table} (date, hour, borough, complaint_type, temperature_C, cnt) "
+                    + ROLLUP_SELECT_SQL.format(table=table, where=where), params)
+        keys = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    print(f"Rollup: {keys} keys for {since or 'start'} .. {until or 'end'} in {round(time.time() - t0, 2)}s")
+    return keys
+
+
+def bump_data_version(conn, table, changed_since=None):
+    cur = conn.cursor()
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {version_table} (
+            name VARCHAR(64) NOT NULL PRIMARY KEY,
+            version BIGINT UNSIGNED NOT NULL,
+            changed_since DATE NULL,
+            updated_at DATETIME NOT NULL
+        )
+    """)
+    cur.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'changed_since'
+    """, (version_table,))
+    if not cur.fetchone()[0]:
+        cur.execute(f"ALTER TABLE {version_table} ADD COLUMN changed_since DATE NULL AFTER version")
+    cur.execute(
+        f"INSERT INTO {version_table} (name, version, changed_since, updated_at) VALUES (%s, 1, %s, UTC_TIMESTAMP()) "
+        f"ON DUPLICATE KEY UPDATE version = version + 1, changed_since = VALUES(changed_since), "
+        f"updated_at = UTC_TIMESTAMP()",
+        (table, changed_since),
+    )
+    cur.close()
+
+
+def track_dates(rows, span):
+    # Passes rows through, recording the first and last date in span
+    for row in rows:
+        if not span:
+            span.extend((row[0], row[0]))
+        elif row[0] < span[0]:
+            span[0] = row[0]
+        elif row[0] > span[1]:
+            span[1] = row[0]
+        yield row
+
+
+def day_after(day):
+    return (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load merged complaints into MySQL")
+    parser.add_argument("--input", default=merged_file)
+    parser.add_argument("--config", default=config_file)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--method", choices=["values", "infile"], default="values",
+                        help="multi-row INSERT ... VALUES, or LOAD DATA LOCAL INFILE per batch")
+    parser.add_argument("--resume-from", type=int, default=0, help="skip this many source rows")
+    parser.add_argument("--workers", type=int, default=1, help="insert batches over N connections")
+    parser.add_argument("--defer-indexes", action="store_true",
+                        help="drop secondary indexes for the load and rebuild them once at the end")
+    parser.add_argument("--restore-indexes", action="store_true",
+                        help="only rebuild indexes left dropped by an interrupted load")
+    parser.add_argument("--incremental", action="store_true",
+                        help="upsert only changed partitions / rows since the high-water mark")
+    parser.add_argument("--no-rollup", action="store_true", help=f"skip refreshing {rollup_table}")
+    parser.add_argument("--rollup-only", action="store_true", help=f"only rebuild {rollup_table} from the table")
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    table = config.get('tables', {}).get('complaints', 'nyc_complaints')
+    conn = connect(config['db'], local_infile=args.method == "infile")
+    try:
+        span = []
+        spans = [] if args.no_rollup else None
+        if args.rollup_only:
+            spans = [(None, None)]
+        elif args.restore_indexes:
+            restore_indexes(conn)
+            spans = []
+        elif args.incremental:
+            _, _, changed = incremental_load(conn, table, args.input, args.batch_size)
+            spans = spans if spans is not None else changed
+        elif args.workers > 1 or args.defer_indexes:
+            before = count_rows(conn, table)
+            if args.defer_indexes:
+                drop_indexes(conn, table)
+            try:
+                rows = track_dates(itertools.islice(read_merged(args.input), args.resume_from, None), span)
+                source, loaded = parallel_load(config['db'], table, rows, max(args.workers, 1),
+                                               args.batch_size, args.method)
+            finally:
+                restore_indexes(conn)
+            added = count_rows(conn, table) - before
+            if added != source:
+                raise SystemExit(f"Row count mismatch: {source} source rows, {added} new rows in {table}")
+            print(f"Verified: {added} new rows in {table} match the source")
+        else:
+            load(conn, table, track_dates(read_merged(args.input), span), args.batch_size, args.method,
+                 args.resume_from)
+        if spans is None:
+            spans = [(span[0], day_after(span[1]))] if span else []
+        for since, until in spans:
+            refresh_rollup(conn, table, since, until)
+        if not args.restore_indexes:
+            starts = [since for since, _ in spans]
+            bump_data_version(conn, table, None if not starts or None in starts else min(starts))
+    finally:
+        conn.close()
@@ -1,26 +1,637 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, g, request, render_template_string
+import gzip
 import pymysql
+import queue
+import threading
 import time
 import json
 import yaml
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from temp_buckets import DEFAULT_EDGES, TempBuckets
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 app = Flask(__name__)
 
-def get_connection():
-    with open("config.yaml", 'r') as file:
+# Endpoint queries. They read complaint_rollup, the per (date, hour,
+# borough, complaint_type) counts that test4.py keeps in step with
+# nyc_complaints, so their cost does not grow with the raw row count.
+# schema.py EXPLAINs them against the rollup's indexes.
+BOROUGH_FILTER = "borough IN ('MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND')"
+HOURLY_SQL = f"""
+            SELECT hour AS hr, borough, CAST(SUM(cnt) AS UNSIGNED) AS cnt
+            FROM complaint_rollup
+            WHERE {BOROUGH_FILTER}
+            GROUP BY hr, borough
+            ORDER BY hr, borough
+        """
+HOUR_BOROUGH_SQL = f"""
+            SELECT borough, CAST(SUM(cnt) AS UNSIGNED) AS cnt
+            FROM complaint_rollup
+            WHERE hour = %s AND {BOROUGH_FILTER}
+            GROUP BY borough
+            ORDER BY borough
+        """
+DATE_RANGE_SQL = f"""
+            SELECT borough, CAST(SUM(cnt) AS UNSIGNED) AS cnt
+            FROM complaint_rollup
+            WHERE {BOROUGH_FILTER}
+              AND date BETWEEN %s AND %s
+            GROUP BY borough
+            ORDER BY borough
+        """
+DATE_HOUR_SQL = f"""
+            SELECT hour AS hr, borough, CAST(SUM(cnt) AS UNSIGNED) AS cnt
+            FROM complaint_rollup
+            WHERE {BOROUGH_FILTER}
+              AND date BETWEEN %s AND %s
+              AND {{hour_condition}}
+            GROUP BY hr, borough
+            ORDER BY hr, borough
+        """
+TOP_BY_TIME_SQL = f"""
+        SELECT borough, complaint_type, CAST(SUM(cnt) AS UNSIGNED) as cnt
+        FROM complaint_rollup
+        WHERE hour BETWEEN %s AND %s
+        AND {BOROUGH_FILTER}
+        GROUP BY borough, complaint_type
+        ORDER BY borough, cnt DESC, complaint_type COLLATE utf8mb4_bin
+    """
+# {temp_bucket} is filled in with TempBuckets.sql_case(), the bucket number
+TEMP_BUCKET_SQL = """
+            SELECT {temp_bucket} AS bucket,
+                CAST(SUM(cnt) AS UNSIGNED) AS count
+            FROM complaint_rollup
+            WHERE temperature_C IS NOT NULL
+            GROUP BY bucket
+            ORDER BY count DESC, bucket
+        """
+TOP_BY_TEMP_SQL = """
+            SELECT {temp_bucket} AS bucket,
+                complaint_type,
+                CAST(SUM(cnt) AS UNSIGNED) as cnt
+            FROM complaint_rollup
+            WHERE temperature_C IS NOT NULL
+            GROUP BY bucket, complaint_type
+            ORDER BY bucket, cnt DESC, complaint_type COLLATE utf8mb4_bin
+        """
+BOROUGH_TEMP_SQL = f"""
+            SELECT 
+                borough,
+                {{temp_bucket}} AS bucket,
+                CAST(SUM(cnt) AS UNSIGNED) AS count
+            FROM complaint_rollup
+            WHERE temperature_C IS NOT NULL
+              AND {BOROUGH_FILTER}
+            GROUP BY bucket, borough
+            ORDER BY bucket, count DESC, borough
+        """
+TEMP_RANGE_SQL = """
+            SELECT {temp_bucket} AS bucket,
+                complaint_type,
+                CAST(SUM(cnt) AS UNSIGNED) as cnt
+            FROM complaint_rollup
+            WHERE borough = %s
+              AND date BETWEEN %s AND %s
+              AND {hour_clause}
+              AND temperature_C IS NOT NULL
+            GROUP BY bucket, complaint_type
+            ORDER BY bucket, cnt DESC, complaint_type COLLATE utf8mb4_bin
+        """
+# Keeps the first k rows per partition of a grouped complaint_type
+# breakdown (MySQL 8 window function), so only those rows leave the
+# server. Ties on cnt are broken by type name in binary (code point)
+# order, which memory_backend.py reproduces; the table's case-insensitive
+# collation would order "DOF Property" after "Damaged Tree".
+TOP_K_SQL = """
+            SELECT {columns}
+            FROM (
+                SELECT grouped.*,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY {partition} ORDER BY cnt DESC, complaint_type COLLATE utf8mb4_bin
+                    ) AS rn
+                FROM ({grouped}) grouped
+            ) ranked
+            WHERE rn <= %s
+            ORDER BY {partition}, cnt DESC, complaint_type COLLATE utf8mb4_bin
+        """
+TOP_K_MAX = 100
+
+config_file = "config.yaml"
+
+
+class ConnectionPool:
+    # Up to `size` open connections shared by the request threads. A checkout
+    # reuses the most recently returned idle connection, pinging it first if
+    # it sat unused for ping_after seconds, and retires connections older
+    # than max_lifetime. A connection that raised a connection error is
+    # closed instead of going back to the pool.
+    def __init__(self, db_config, size=8, max_lifetime=3600, ping_after=30, timeout=10):
+        self.db_config = db_config
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self.opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _open(self):
+        conn = pymysql.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            user=self.db_config['user'],
+            passwd=self.db_config['passwd'],
+            db=self.db_config['db'],
+            autocommit=True,
+            cursorclass=pymysql.cursors.DictCursor
+        )
+        self.opened += 1
+        now = time.time()
+        return [conn, now, now]
+
+    def _checkout(self):
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+            conn, created, last_used = entry
+            now = time.time()
+            try:
+                if now - created > self.max_lifetime:
+                    raise pymysql.err.InterfaceError("max lifetime reached")
+                if now - last_used > self.ping_after:
+                    conn.ping(reconnect=False)
+                return entry
+            except pymysql.err.Error:
+                self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise RuntimeError("No database connection free in the pool")
+        entry = None
+        broken = False
+        try:
+            entry = self._checkout()
+            yield entry[0]
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if entry is not None:
+                if broken:
+                    self._close(entry[0])
+                else:
+                    entry[2] = time.time()
+                    self._idle.put(entry)
+            self._slots.release()
+
+
+class ResultCache:
+    # LRU of query results with a TTL, keyed on the SQL text plus its
+    # normalized parameters, so routes running the same query share entries.
+    def __init__(self, size=256, ttl=300):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, rows):
+        with self._lock:
+            self._entries[key] = (time.time(), rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_size': self.size,
+                    'ttl': self.ttl}
+
+
+config = None
+pool = None
+cache = ResultCache()
+# buckets of the four temperature routes; edges from config.yaml
+buckets = TempBuckets()
+# MemoryBackend when config.yaml sets backend: memory (see memory_backend.py)
+memory = None
+memory_source = None
+_memory_lock = threading.Lock()
+_pool_lock = threading.Lock()
+
+# test4.py bumps data_version after every load, under the configured
+# tables.complaints name; the cache is dropped when it changes. Checked at
+# most every version_check seconds.
+complaints_table = 'nyc_complaints'
+version_check = 5
+data_version = None
+data_updated_at = None
+_version_checked_at = 0
+_version_seen = False
+
+# Conditional GETs for the data routes. The weak ETag is the data_version
+# plus the bucket edges and Last-Modified is its updated_at, so browsers
+# and a reverse proxy revalidate with a 304 that runs no endpoint query.
+# No headers while no version is known (no load yet, a memory backend
+# loaded from a file, or the database unreachable). Error and validation
+# responses are sent with Cache-Control: no-store instead.
+http_max_age = 60
+cacheable_endpoints = {
+    'get_hourly_complaints', 'graph', 'hourly_data', 'date_range_data', 'date_hour_data', 'top_complaints_by_time',
+    'complaints_by_temp', 'top_complaints_by_temp', 'borough_temp', 'complaints_by_temp_range', 'dashboard_data',
+}
+keyed_endpoints = cacheable_endpoints - {'graph', 'hourly_data'}
+
+# JSON and HTML responses of at least compress_min_size bytes are sent
+# brotli- or gzip-encoded when the client accepts it
+compress_min_size = 1024
+compressible_types = {'application/json', 'text/html'}
+
+
+def init_pool(path=config_file):
+    # Reads config.yaml once; the pool and cache settings are optional
+    global config, pool, cache, version_check, buckets, http_max_age, complaints_table
+    with open(path, 'r') as file:
         config = yaml.safe_load(file)
-    db_config = config['db']
-
-    return pymysql.connect(
-        host=db_config['host'],
-        port=db_config['port'],
-        user=db_config['user'],
-        passwd=db_config['passwd'],
-        db=db_config['db'],
-        autocommit=True,
-        cursorclass=pymysql.cursors.DictCursor
-    )
+    complaints_table = config.get('tables', {}).get('complaints', 'nyc_complaints')
+    pool = ConnectionPool(config['db'], **config.get('pool', {}))
+    cache_config = dict(config.get('cache', {}))
+    version_check = cache_config.pop('version_check', version_check)
+    cache = ResultCache(**cache_config)
+    buckets = TempBuckets(config.get('temp_buckets', DEFAULT_EDGES))
+    http_max_age = config.get('http_cache', {}).get('max_age', http_max_age)
+    if config.get('backend', 'sql') == 'memory':
+        init_memory(config.get('memory_source', 'mysql'), config.get('memory_type_cube', False))
+    return pool
+
+
+def init_memory(source='mysql', type_cube=False):
+    # Loads the complaints into memory once; source is 'mysql' (the
+    # complaint_rollup table, followed as loads bump data_version) or a
+    # path read_merged accepts (a snapshot)
+    global memory, memory_source
+    from memory_backend import MemoryBackend
+    t0 = time.time()
+    if source == 'mysql':
+        with db_cursor() as cur:
+            memory = MemoryBackend.from_rollup(cur, type_cube, buckets)
+    else:
+        memory = MemoryBackend.from_merged(source, type_cube, buckets)
+    memory_source = source
+    print(f"Memory backend: {len(memory)} keys from {source} in {round(time.time() - t0, 2)}s")
+    return memory
+
+
+def get_pool():
+    if pool is None:
+        with _pool_lock:
+            if pool is None:
+                init_pool()
+    return pool
+
+
+@contextmanager
+def db_cursor():
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+def version_check_due():
+    # a memory backend loaded from a file is a snapshot
+    if memory is not None and memory_source != 'mysql':
+        return False
+    return time.time() - _version_checked_at >= version_check
+
+
+def check_data_version():
+    global data_version, data_updated_at, _version_checked_at, _version_seen
+    if not version_check_due():
+        return
+    try:
+        with db_cursor() as cur:
+            cur.execute("SELECT version, changed_since, updated_at FROM data_version WHERE name = %s",
+                        (complaints_table,))
+            row = cur.fetchone()
+    except pymysql.err.ProgrammingError:
+        # no loader has run against this database yet
+        row = None
+    # other errors propagate and the next request checks again
+    _version_checked_at = time.time()
+    version = row['version'] if row else None
+    # test4.py writes updated_at in UTC
+    data_updated_at = row['updated_at'].replace(tzinfo=timezone.utc) if row and row['updated_at'] else None
+    if version != data_version or not _version_seen:
+        # the first check only records the version the data was loaded at
+        if memory is not None and _version_seen:
+            refresh_memory(row['changed_since'] if row else None)
+        cache.clear()
+        data_version = version
+        _version_seen = True
+
+
+def refresh_memory(changed_since):
+    # Pulls the rollup rows from changed_since on and updates the in-memory
+    # arrays and prefix cubes from that day forward; everything when None
+    global memory
+    from memory_backend import MemoryBackend
+    since = changed_since.isoformat() if changed_since else None
+    with db_cursor() as cur:
+        rows = MemoryBackend.rollup_rows(cur, since)
+    with _memory_lock:
+        if since:
+            memory.replace_from(since, rows)
+        else:
+            memory = MemoryBackend.from_counts(rows, memory.type_cube, memory.buckets)
+
+
+def run_query(name, sql, params=(), args=None):
+    # (rows, seconds, cached). name is the MemoryBackend method answering
+    # the same question as sql, called with args (default: params). Rows
+    # are copies, so handlers may modify them.
+    try:
+        check_data_version()
+    except pymysql.err.Error:
+        # a memory backend keeps answering from the data it has
+        if memory is None:
+            g.no_cache = True
+            raise
+    args = params if args is None else args
+    key = (name, args)
+    t0 = time.time()
+    rows = cache.get(key)
+    cached = rows is not None
+    if not cached:
+        try:
+            if memory is not None:
+                with _memory_lock:
+                    rows = memory.query(name, args)
+            else:
+                with db_cursor() as cur:
+                    cur.execute(sql, params)
+                    rows = cur.fetchall()
+        except Exception:
+            # the handler's error response must not be cached downstream
+            g.no_cache = True
+            raise
+        cache.put(key, rows)
+    return [dict(row) for row in rows], time.time() - t0, cached
+
+
+def top_k_sql(grouped, partition, columns):
+    # grouped's parameters come first, then k
+    return TOP_K_SQL.format(grouped=grouped, partition=partition, columns=columns)
+
+
+def top_k_arg(args, default=None):
+    # ?k= for the top-K routes; None (everything) when absent without a default
+    k = args.get('k', default, type=int)
+    if k is not None and not 1 <= k <= TOP_K_MAX:
+        raise ValueError(f"k must be between 1 and {TOP_K_MAX}")
+    return k
+
+
+def temp_sql(sql, **parts):
+    # Fills the {temp_bucket} placeholder with the configured bucket CASE
+    return sql.format(temp_bucket=buckets.sql_case(), **parts)
+
+
+def hour_window(start_hr, end_hr):
+    # SQL condition for the hour range (wrapping past midnight when
+    # start_hr > end_hr; both take start_hr, end_hr) and its hours in order
+    if start_hr <= end_hr:
+        return "hour BETWEEN %s AND %s", list(range(start_hr, end_hr + 1))
+    return "(hour >= %s OR hour <= %s)", list(range(start_hr, 24)) + list(range(0, end_hr + 1))
+
+
+def top_by_time_query(start_hr, end_hr, k):
+    # only the top k types of each borough come back
+    return top_k_sql(TOP_BY_TIME_SQL, 'borough', 'borough, complaint_type, cnt'), (start_hr, end_hr, k)
+
+
+def temp_range_query(borough, start, end, start_hr, end_hr, k=None):
+    sql = temp_sql(TEMP_RANGE_SQL, hour_clause=hour_window(start_hr, end_hr)[0])
+    params = ((borough or '').strip().upper(), normalize_date(start), normalize_date(end), start_hr, end_hr)
+    if k is not None:
+        return top_k_sql(sql, 'bucket', 'bucket, complaint_type, cnt'), params + (k,)
+    return sql, params
+
+
+# Chart data from query rows; shared with async_app.py
+
+def hourly_series(rows):
+    data_by_borough = {}
+    for row in rows:
+        b = row['borough']
+        if b not in data_by_borough:
+            data_by_borough[b] = [0]*24
+        data_by_borough[b][row['hr']] = row['cnt']
+    return data_by_borough
+
+
+def hour_series(rows, hours):
+    data_by_borough = {}
+    for row in rows:
+        data_by_borough.setdefault(row['borough'], {})[row['hr']] = row['cnt']
+    return {b: [counts.get(h, 0) for h in hours] for b, counts in data_by_borough.items()}
+
+
+def top_chart(rows):
+    labels = sorted(set(row['complaint_type'] for row in rows))
+    positions = {label: i for i, label in enumerate(labels)}
+    boroughs = ['MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND']
+    dataset = {b: [0]*len(labels) for b in boroughs}
+    for row in rows:
+        dataset[row['borough']][positions[row['complaint_type']]] = row['cnt']
+    return labels, dataset
+
+
+def bucket_series(rows):
+    by_bucket = {}
+    for row in buckets.label_rows(rows):
+        by_bucket.setdefault(row['temp_bucket'], []).append({
+            'complaint_type': row['complaint_type'],
+            'cnt': row['cnt']
+        })
+    return by_bucket
+
+
+def http_validators():
+    # (etag, last_modified) for the current data, or None
+    if data_version is None:
+        return None
+    return f"v{data_version}-{'_'.join(f'{e:g}' for e in buckets.edges)}", data_updated_at
+
+
+def not_modified(req, validators):
+    # If-None-Match wins over If-Modified-Since when both are sent
+    etag, last_modified = validators
+    if req.if_none_match:
+        return req.if_none_match.contains_weak(etag)
+    return bool(last_modified and req.if_modified_since and last_modified <= req.if_modified_since)
+
+
+def set_cache_headers(response, validators):
+    etag, last_modified = validators
+    # weak: the data matches, sqltime and cached may not
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = http_max_age
+    return response
+
+
+def revalidates(req):
+    # Data routes, except those with a wrong key: the handler answers
+    # 'Invalid key' without touching the database
+    if req.endpoint not in cacheable_endpoints:
+        return False
+    return req.endpoint not in keyed_endpoints or req.args.get('key') == '123'
+
+
+def uncached(body):
+    # error and validation messages returned with a 200
+    g.no_cache = True
+    return body
+
+
+@app.before_request
+def conditional_get():
+    if not revalidates(request):
+        return None
+    try:
+        check_data_version()
+    except pymysql.err.Error:
+        # version unknown: no validators, the handler reports the error
+        return None
+    g.validators = http_validators()
+    if g.validators and not_modified(request, g.validators):
+        return '', 304
+
+
+@app.after_request
+def cache_headers(response):
+    if request.endpoint not in cacheable_endpoints:
+        return response
+    if g.get('no_cache') or response.status_code not in (200, 304):
+        response.cache_control.no_store = True
+    elif g.get('validators'):
+        set_cache_headers(response, g.validators)
+    return response
+
+
+def columnar(rows):
+    # ?format=columnar shape: one array per column instead of one dict per
+    # row; text columns hold codes into that column's labels
+    columns, labels = {}, {}
+    for name in (rows[0] if rows else ()):
+        values = [row[name] for row in rows]
+        if any(isinstance(v, str) for v in values):
+            codes = {}
+            columns[name] = [codes.setdefault(v, len(codes)) for v in values]
+            labels[name] = list(codes)
+        else:
+            columns[name] = values
+    return {'rows': len(rows), 'columns': columns, 'labels': labels}
+
+
+def json_body(res, shape=None):
+    # Serialized response; data (or each /dashboardData section) reshaped
+    # when shape is 'columnar'. orjson when installed.
+    if shape == 'columnar' and 'data' in res:
+        data = res['data']
+        if isinstance(data, dict):
+            data = {section: columnar(rows) for section, rows in data.items()}
+        else:
+            data = columnar(data)
+        res = {**res, 'format': 'columnar', 'data': data}
+    if orjson is not None:
+        return orjson.dumps(res, default=str)
+    return json.dumps(res, separators=(',', ':'), default=str).encode()
+
+
+def json_response(res):
+    if res.get('code') != 1:
+        g.no_cache = True
+    return app.response_class(json_body(res, request.args.get('format')), mimetype='application/json')
+
+
+def encode_body(body, accept_encodings):
+    # (Content-Encoding, encoded body) for the client's preferred encoding,
+    # or None when the body is small or nothing acceptable is available
+    if len(body) < compress_min_size:
+        return None
+    encoding = accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    if encoding == 'br':
+        return 'br', brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return 'gzip', gzip.compress(body, compresslevel=6)
+    return None
+
+
+@app.after_request
+def compress(response):
+    if (response.mimetype not in compressible_types or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.status_code == 200:
+        encoded = encode_body(response.get_data(), request.accept_encodings)
+        if encoded:
+            response.headers['Content-Encoding'], body = encoded
+            response.set_data(body)
+    return response
+
+
+def normalize_date(value):
+    # YYYY-M-D and padded forms map to one cache key; anything else is
+    # passed through for MySQL to judge as before
+    value = (value or '').strip()
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        return value
+
 
 @app.route('/')
 def home():
@@ -40,69 +651,25 @@ def get_hourly_complaints():
     if key != '123':
         res['code'] = 0
         res['msg'] = 'Invalid key'
-        return jsonify(res)
-
-    conn = None
-    cur = None
+        return json_response(res)
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        sql = """
-            SELECT hour AS hr, borough, COUNT(*) AS cnt
-            FROM nyc_complaints
-            WHERE borough IN ('MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND')
-            GROUP BY hr, borough
-            ORDER BY hr, borough
-        """
-        t0 = time.time()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        t1 = time.time()
+        rows, sqltime, cached = run_query('hourly', HOURLY_SQL)
 
         res.update({
             'code': 1,
             'msg': 'ok',
-            'sqltime': round(t1 - t0, 4),
+            'sqltime': round(sqltime, 4),
+            'cached': cached,
             'data': rows
         })
 
     except Exception as e:
         res.update({'code': 0, 'msg': f'Error: {str(e)}'})
 
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-
-    return jsonify(res)
-
-@app.route('/graph')
-def graph():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT hour AS hr, borough, COUNT(*) AS cnt
-        FROM nyc_complaints
-        WHERE borough IN ('MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND')
-        GROUP BY hr, borough
-        ORDER BY hr, borough
-    """)
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
-
-    data_by_borough = {}
-    for row in data:
-        b = row['borough']
-        if b not in data_by_borough:
-            data_by_borough[b] = [0]*24
-        data_by_borough[b][row['hr']] = row['cnt']
-
-    hours = list(range(24))
+    return json_response(res)
 
-    return render_template_string('''
+GRAPH_HTML = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -138,7 +705,12 @@ def graph():
         </script>
     </body>
     </html>
-    ''', hours=hours, data=data_by_borough)
+    '''
+
+@app.route('/graph')
+def graph():
+    data, _, _ = run_query('hourly', HOURLY_SQL)
+    return render_template_string(GRAPH_HTML, hours=list(range(24)), data=hourly_series(data))
 
 @app.route('/hourlyInput')
 def hourly_input():
@@ -159,30 +731,7 @@ def hourly_input():
     </html>
     '''
 
-@app.route('/hourlyData')
-def hourly_data():
-    try:
-        hour = int(request.args.get('hour'))
-        if not (0 <= hour <= 23):
-            return "Hour must be between 0 and 23"
-
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT borough, COUNT(*) AS cnt
-            FROM nyc_complaints
-            WHERE hour = %s AND borough IN ('MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND')
-            GROUP BY borough
-            ORDER BY borough
-        """, (hour,))
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        boroughs = [row['borough'] for row in rows]
-        counts = [row['cnt'] for row in rows]
-
-        return render_template_string('''
+HOURLY_HTML = '''
         <!DOCTYPE html>
         <html>
         <head>
@@ -215,10 +764,24 @@ def hourly_data():
             </script>
         </body>
         </html>
-        ''', hour=hour, boroughs=boroughs, counts=counts)
+        '''
+
+@app.route('/hourlyData')
+def hourly_data():
+    try:
+        hour = int(request.args.get('hour'))
+        if not (0 <= hour <= 23):
+            return uncached("Hour must be between 0 and 23")
+
+        rows, _, _ = run_query('hour_borough', HOUR_BOROUGH_SQL, (hour,))
+
+        boroughs = [row['borough'] for row in rows]
+        counts = [row['cnt'] for row in rows]
+
+        return render_template_string(HOURLY_HTML, hour=hour, boroughs=boroughs, counts=counts)
 
     except Exception as e:
-        return f" Error: {e}"
+        return uncached(f" Error: {e}")
     
 
 @app.route('/dateRangeInput')
@@ -234,42 +797,7 @@ def date_range_input():
     '''
 
 
-@app.route('/dateRangeData')
-def date_range_data():
-    start = request.args.get('start')
-    end = request.args.get('end')
-    key = request.args.get('key')
-
-    res = {'req': 'dateRangeData'}
-
-    if key != '123':
-        res['code'] = 0
-        res['msg'] = 'Invalid key'
-        return jsonify(res)
-
-    conn = None
-    cur = None
-
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        sql = """
-            SELECT borough, COUNT(*) AS cnt
-            FROM nyc_complaints
-            WHERE borough IN ('MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND')
-              AND date BETWEEN %s AND %s
-            GROUP BY borough
-            ORDER BY borough
-        """
-        t0 = time.time()
-        cur.execute(sql, (start, end))
-        rows = cur.fetchall()
-        t1 = time.time()
-
-        boroughs = [row['borough'] for row in rows]
-        counts = [row['cnt'] for row in rows]
-
-        return render_template_string('''
+DATE_RANGE_HTML = '''
         <!DOCTYPE html>
         <html>
         <head>
@@ -301,20 +829,33 @@ def date_range_data():
             </script>
         </body>
         </html>
-        ''', start=start, end=end, boroughs=boroughs, counts=counts)
+        '''
+
+@app.route('/dateRangeData')
+def date_range_data():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    key = request.args.get('key')
+
+    res = {'req': 'dateRangeData'}
+
+    if key != '123':
+        res['code'] = 0
+        res['msg'] = 'Invalid key'
+        return json_response(res)
+
+    try:
+        rows, _, _ = run_query('date_range', DATE_RANGE_SQL, (normalize_date(start), normalize_date(end)))
+
+        boroughs = [row['borough'] for row in rows]
+        counts = [row['cnt'] for row in rows]
+
+        return render_template_string(DATE_RANGE_HTML, start=start, end=end, boroughs=boroughs, counts=counts)
 
     except Exception as e:
         res['code'] = 0
         res['msg'] = f'Error: {str(e)}'
-        return jsonify(res)
-
-    finally:
-        try:
-            if cur: cur.close()
-        except: pass
-        try:
-            if conn: conn.close()
-        except: pass
+        return json_response(res)
 
 @app.route('/dateHourInput')
 def date_hour_input():
@@ -330,65 +871,7 @@ def date_hour_input():
     </form>
     '''
 
-@app.route('/dateHourData')
-def date_hour_data():
-    start = request.args.get('start')
-    end = request.args.get('end')
-    start_hr = request.args.get('start_hr', type=int)
-    end_hr = request.args.get('end_hr', type=int)
-    key = request.args.get('key')
-
-    res = {'req': 'dateHourData'}
-
-    if key != '123':
-        res['code'] = 0
-        res['msg'] = 'Invalid key'
-        return jsonify(res)
-
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        if start_hr <= end_hr:
-            hour_condition = "hour BETWEEN %s AND %s"
-            hour_params = (start_hr, end_hr)
-            hours = list(range(start_hr, end_hr + 1))
-        else:
-            hour_condition = "(hour >= %s OR hour <= %s)"
-            hour_params = (start_hr, end_hr)
-            hours = list(range(start_hr, 24)) + list(range(0, end_hr + 1))
-
-        sql = f"""
-            SELECT hour AS hr, borough, COUNT(*) AS cnt
-            FROM nyc_complaints
-            WHERE borough IN ('MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND')
-              AND date BETWEEN %s AND %s
-              AND {hour_condition}
-            GROUP BY hr, borough
-            ORDER BY hr, borough
-        """
-
-        t0 = time.time()
-        cur.execute(sql, (start, end, *hour_params))
-        rows = cur.fetchall()
-        t1 = time.time()
-
-        cur.close()
-        conn.close()
-
-        data_by_borough = {}
-        for row in rows:
-            b = row['borough']
-            h = row['hr']
-            if b not in data_by_borough:
-                data_by_borough[b] = {}
-            data_by_borough[b][h] = row['cnt']
-
-        final_data = {}
-        for b in data_by_borough:
-            final_data[b] = [data_by_borough[b].get(h, 0) for h in hours]
-
-        return render_template_string('''
+DATE_HOUR_HTML = '''
         <!DOCTYPE html>
         <html>
         <head>
@@ -424,87 +907,47 @@ def date_hour_data():
             </script>
         </body>
         </html>
-        ''', start=start, end=end, start_hr=start_hr, end_hr=end_hr, hours=hours, data=final_data)
-
-    except Exception as e:
-        res['code'] = 0
-        res['msg'] = f'Error: {str(e)}'
-        return jsonify(res)
-
-
-TIME_BUCKETS = {
-    'night': (0, 5),
-    'morning': (6, 11),
-    'afternoon': (12, 17),
-    'evening': (18, 23)
-}
+        '''
 
-@app.route('/topComplaintsByTime')
-def top_complaints_by_time():
+@app.route('/dateHourData')
+def date_hour_data():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start_hr = request.args.get('start_hr', type=int)
+    end_hr = request.args.get('end_hr', type=int)
     key = request.args.get('key')
-    bucket = request.args.get('bucket', 'night').lower()
 
-    res = {'req': 'topComplaintsByTime'}
+    res = {'req': 'dateHourData'}
 
     if key != '123':
         res['code'] = 0
         res['msg'] = 'Invalid key'
-        return jsonify(res)
-
-    if bucket not in TIME_BUCKETS:
-        res['code'] = 0
-        res['msg'] = f"Invalid time bucket. Choose from {list(TIME_BUCKETS.keys())}"
-        return jsonify(res)
+        return json_response(res)
 
-    start_hr, end_hr = TIME_BUCKETS[bucket]
-    conn = get_connection()
-    cur = conn.cursor()
-
-    sql = '''
-        SELECT borough, complaint_type, COUNT(*) as cnt
-        FROM nyc_complaints
-        WHERE hour BETWEEN %s AND %s
-        AND borough IN ('MANHATTAN','BROOKLYN','QUEENS','BRONX','STATEN ISLAND')
-        GROUP BY borough, complaint_type
-        ORDER BY borough, cnt DESC
-    '''
-
-    t0 = time.time()
-    cur.execute(sql, (start_hr, end_hr))
-    rows = cur.fetchall()
-    t1 = time.time()
+    try:
+        hour_condition, hours = hour_window(start_hr, end_hr)
+        sql = DATE_HOUR_SQL.format(hour_condition=hour_condition)
 
-    cur.close()
-    conn.close()
+        rows, _, _ = run_query('date_hour', sql, (normalize_date(start), normalize_date(end), start_hr, end_hr))
+        final_data = hour_series(rows, hours)
 
-    top_complaints = []
-    borough_counts = {}
-    for row in rows:
-        b = row['borough']
-        if b not in borough_counts:
-            borough_counts[b] = 0
-        if borough_counts[b] < 3:
-            top_complaints.append(row)
-            borough_counts[b] += 1
+        return render_template_string(DATE_HOUR_HTML, start=start, end=end, start_hr=start_hr, end_hr=end_hr,
+                                      hours=hours, data=final_data)
 
+    except Exception as e:
+        res['code'] = 0
+        res['msg'] = f'Error: {str(e)}'
+        return json_response(res)
 
-    labels = list(set([row['complaint_type'] for row in top_complaints]))
-    labels.sort()
-    boroughs = ['MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND']
-    dataset = {b: [0]*len(labels) for b in boroughs}
-    for row in top_complaints:
-        b = row['borough']
-        idx = labels.index(row['complaint_type'])
-        dataset[b][idx] = row['cnt']
 
-    res.update({
-        'code': 1,
-        'msg': 'ok',
-        'sqltime': round(t1 - t0, 4),
-        'data': top_complaints
-    })
+TIME_BUCKETS = {
+    'night': (0, 5),
+    'morning': (6, 11),
+    'afternoon': (12, 17),
+    'evening': (18, 23)
+}
 
-    return render_template_string('''
+TOP_BY_TIME_HTML = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -540,7 +983,46 @@ def top_complaints_by_time():
         </script>
     </body>
     </html>
-    ''', bucket=bucket, start_hr=start_hr, end_hr=end_hr, labels=labels, dataset=dataset)
+    '''
+
+@app.route('/topComplaintsByTime')
+def top_complaints_by_time():
+    key = request.args.get('key')
+    bucket = request.args.get('bucket', 'night').lower()
+
+    res = {'req': 'topComplaintsByTime'}
+
+    if key != '123':
+        res['code'] = 0
+        res['msg'] = 'Invalid key'
+        return json_response(res)
+
+    if bucket not in TIME_BUCKETS:
+        res['code'] = 0
+        res['msg'] = f"Invalid time bucket. Choose from {list(TIME_BUCKETS.keys())}"
+        return json_response(res)
+
+    try:
+        k = top_k_arg(request.args, 3)
+    except ValueError as e:
+        res['code'] = 0
+        res['msg'] = str(e)
+        return json_response(res)
+
+    start_hr, end_hr = TIME_BUCKETS[bucket]
+    top_complaints, sqltime, cached = run_query('top_by_time', *top_by_time_query(start_hr, end_hr, k))
+    labels, dataset = top_chart(top_complaints)
+
+    res.update({
+        'code': 1,
+        'msg': 'ok',
+        'sqltime': round(sqltime, 4),
+        'cached': cached,
+        'data': top_complaints
+    })
+
+    return render_template_string(TOP_BY_TIME_HTML, bucket=bucket, start_hr=start_hr, end_hr=end_hr, labels=labels,
+                                  dataset=dataset)
 
 @app.route('/complaintsByTempBucket')
 def complaints_by_temp():
@@ -550,46 +1032,24 @@ def complaints_by_temp():
     if key != '123':
         res['code'] = 0
         res['msg'] = 'Invalid key'
-        return jsonify(res)
+        return json_response(res)
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        sql = """
-            SELECT 
-                CASE 
-                    WHEN temperature_C < 0 THEN '< 0°C'
-                    WHEN temperature_C BETWEEN 0 AND 10 THEN '0-10°C'
-                    WHEN temperature_C BETWEEN 10 AND 20 THEN '10-20°C'
-                    ELSE '> 20°C'
-                END AS temp_bucket,
-                COUNT(*) AS count
-            FROM nyc_complaints
-            WHERE temperature_C IS NOT NULL
-            GROUP BY temp_bucket
-            ORDER BY count DESC
-        """
-
-        t0 = time.time()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        t1 = time.time()
+        rows, sqltime, cached = run_query('temp_bucket', temp_sql(TEMP_BUCKET_SQL))
+        buckets.label_rows(rows)
 
         res.update({
             'code': 1,
             'msg': 'ok',
-            'sqltime': round(t1 - t0, 4),
+            'sqltime': round(sqltime, 4),
+            'cached': cached,
             'data': rows
         })
 
     except Exception as e:
         res.update({'code': 0, 'msg': f'Error: {str(e)}'})
 
-    finally:
-        if conn: conn.close()
-
-    return jsonify(res)
+    return json_response(res)
 
 @app.route('/topComplaintTypesByTemp')
 def top_complaints_by_temp():
@@ -599,43 +1059,20 @@ def top_complaints_by_temp():
     if key != '123':
         res['code'] = 0
         res['msg'] = 'Invalid key'
-        return jsonify(res)
-
-    temp_ranges = [
-        ('< 0°C', "temperature_C < 0"),
-        ('0-10°C', "temperature_C >= 0 AND temperature_C < 10"),
-        ('10-20°C', "temperature_C >= 10 AND temperature_C <= 20"),
-        ('> 20°C', "temperature_C > 20")
-    ]
-
-    all_results = []
-    conn = None
-    cur = None
+        return json_response(res)
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        t0 = time.time()
+        # one scan over every bucket, keeping the top k types of each
+        k = top_k_arg(request.args, 20)
+        sql = top_k_sql(temp_sql(TOP_BY_TEMP_SQL), 'bucket', 'bucket, complaint_type, cnt')
+        rows, sqltime, cached = run_query('top_by_temp', sql, (k,))
+        all_results = buckets.label_rows(rows)
 
-        for label, condition in temp_ranges:
-            cur.execute(f'''
-                SELECT complaint_type, COUNT(*) as cnt
-                FROM nyc_complaints
-                WHERE {condition}
-                GROUP BY complaint_type
-                ORDER BY cnt DESC
-                LIMIT 20
-            ''')
-            data = cur.fetchall()
-            for row in data:
-                row['temp_bucket'] = label
-                all_results.append(row)
-
-        t1 = time.time()
         res.update({
             'code': 1,
             'msg': 'ok',
-            'sqltime': round(t1 - t0, 4),
+            'sqltime': round(sqltime, 4),
+            'cached': cached,
             'data': all_results
         })
 
@@ -643,13 +1080,7 @@ def top_complaints_by_temp():
         res['code'] = 0
         res['msg'] = f'Error: {str(e)}'
 
-    finally:
-        if cur:
-            cur.close()
-        if conn:
-            conn.close()
-
-    return jsonify(res)
+    return json_response(res)
 
 
 @app.route('/boroughComplaintsByTemp')
@@ -660,48 +1091,24 @@ def borough_temp():
     if key != '123':
         res['code'] = 0
         res['msg'] = 'Invalid key'
-        return jsonify(res)
+        return json_response(res)
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        sql = """
-            SELECT 
-                borough,
-                CASE 
-                    WHEN temperature_C < 0 THEN '< 0°C'
-                    WHEN temperature_C BETWEEN 0 AND 10 THEN '0-10°C'
-                    WHEN temperature_C BETWEEN 10 AND 20 THEN '10-20°C'
-                    ELSE '> 20°C'
-                END AS temp_bucket,
-                COUNT(*) AS count
-            FROM nyc_complaints
-            WHERE temperature_C IS NOT NULL
-              AND borough IN ('MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND')
-            GROUP BY temp_bucket, borough
-            ORDER BY temp_bucket, count DESC
-        """
-
-        t0 = time.time()
-        cur.execute(sql)
-        rows = cur.fetchall()
-        t1 = time.time()
+        rows, sqltime, cached = run_query('borough_temp', temp_sql(BOROUGH_TEMP_SQL))
+        buckets.label_rows(rows)
 
         res.update({
             'code': 1,
             'msg': 'ok',
-            'sqltime': round(t1 - t0, 4),
+            'sqltime': round(sqltime, 4),
+            'cached': cached,
             'data': rows
         })
 
     except Exception as e:
         res.update({'code': 0, 'msg': f'Error: {str(e)}'})
 
-    finally:
-        if conn: conn.close()
-
-    return jsonify(res)
+    return json_response(res)
 
 @app.route('/tempComplaintVisualizer')
 def temp_complaint_visualizer():
@@ -719,76 +1126,13 @@ def temp_complaint_visualizer():
             <option value="BRONX">BRONX</option>
             <option value="STATEN ISLAND">STATEN ISLAND</option>
         </select><br>
+        Top types per bucket (optional): <input type="number" name="k" min="1" max="100"><br>
         <input type="hidden" name="key" value="123">
         <input type="submit" value="Submit">
     </form>
     '''
 
-@app.route('/complaintsByTempRange')
-def complaints_by_temp_range():
-    start = request.args.get('start')
-    end = request.args.get('end')
-    start_hr = int(request.args.get('start_hr'))
-    end_hr = int(request.args.get('end_hr'))
-    borough = request.args.get('borough')
-    key = request.args.get('key')
-
-    res = {'req': 'complaintsByTempRange'}
-
-    if key != '123':
-        res['code'] = 0
-        res['msg'] = 'Invalid key'
-        return jsonify(res)
-
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-
-        if start_hr <= end_hr:
-            hour_clause = "hour BETWEEN %s AND %s"
-            hour_params = (start_hr, end_hr)
-        else:
-            hour_clause = "(hour >= %s OR hour <= %s)"
-            hour_params = (start_hr, end_hr)
-
-        sql = f'''
-            SELECT
-                CASE
-                    WHEN temperature_C < 0 THEN '< 0°C'
-                    WHEN temperature_C BETWEEN 0 AND 10 THEN '0-10°C'
-                    WHEN temperature_C BETWEEN 10 AND 20 THEN '10-20°C'
-                    ELSE '> 20°C'
-                END AS temp_bucket,
-                complaint_type,
-                COUNT(*) as cnt
-            FROM nyc_complaints
-            WHERE borough = %s
-              AND date BETWEEN %s AND %s
-              AND {hour_clause}
-            GROUP BY temp_bucket, complaint_type
-            ORDER BY temp_bucket, cnt DESC
-        '''
-
-        t0 = time.time()
-        cur.execute(sql, (borough, start, end, *hour_params))
-        rows = cur.fetchall()
-        t1 = time.time()
-
-        cur.close()
-        conn.close()
-
-        # Organize data for chart
-        buckets = {}
-        for row in rows:
-            bucket = row['temp_bucket']
-            if bucket not in buckets:
-                buckets[bucket] = []
-            buckets[bucket].append({
-                'complaint_type': row['complaint_type'],
-                'cnt': row['cnt']
-            })
-
-        return render_template_string('''
+TEMP_RANGE_HTML = '''
         <!DOCTYPE html>
         <html>
         <head>
@@ -822,12 +1166,113 @@ def complaints_by_temp_range():
             {% endfor %}
         </body>
         </html>
-        ''', buckets=buckets, borough=borough, start=start, end=end, start_hr=start_hr, end_hr=end_hr)
+        '''
+
+@app.route('/complaintsByTempRange')
+def complaints_by_temp_range():
+    start = request.args.get('start')
+    end = request.args.get('end')
+    start_hr = int(request.args.get('start_hr'))
+    end_hr = int(request.args.get('end_hr'))
+    borough = request.args.get('borough')
+    key = request.args.get('key')
+
+    res = {'req': 'complaintsByTempRange'}
+
+    if key != '123':
+        res['code'] = 0
+        res['msg'] = 'Invalid key'
+        return json_response(res)
+
+    try:
+        # ?k= keeps only the top k types per bucket
+        query = temp_range_query(borough, start, end, start_hr, end_hr, top_k_arg(request.args))
+        rows, _, _ = run_query('temp_range', *query)
+        by_bucket = bucket_series(rows)
+
+        return render_template_string(TEMP_RANGE_HTML, buckets=by_bucket, borough=borough, start=start, end=end,
+                                      start_hr=start_hr, end_hr=end_hr)
 
     except Exception as e:
         res['code'] = 0
         res['msg'] = f'Error: {str(e)}'
-        return jsonify(res)
+        return json_response(res)
     
+def dashboard_queries(bucket, k):
+    # (section, query name, sql, params) behind /dashboardData. They are
+    # independent, so async_app.py runs them concurrently.
+    start_hr, end_hr = TIME_BUCKETS[bucket]
+    return [
+        ('hourly', 'hourly', HOURLY_SQL, ()),
+        ('temp_buckets', 'temp_bucket', temp_sql(TEMP_BUCKET_SQL), ()),
+        ('borough_temp', 'borough_temp', temp_sql(BOROUGH_TEMP_SQL), ()),
+        ('top_by_time', 'top_by_time', *top_by_time_query(start_hr, end_hr, k)),
+    ]
+
+
+def label_buckets(rows):
+    return buckets.label_rows(rows) if rows and 'bucket' in rows[0] else rows
+
+
+@app.route('/dashboardData')
+def dashboard_data():
+    # Everything the dashboard charts need in one response
+    key = request.args.get('key')
+    bucket = request.args.get('bucket', 'night').lower()
+    res = {'req': 'dashboardData'}
+
+    if key != '123':
+        res['code'] = 0
+        res['msg'] = 'Invalid key'
+        return json_response(res)
+
+    if bucket not in TIME_BUCKETS:
+        res['code'] = 0
+        res['msg'] = f"Invalid time bucket. Choose from {list(TIME_BUCKETS.keys())}"
+        return json_response(res)
+
+    try:
+        t0 = time.time()
+        data = {}
+        cached = True
+        for section, name, sql, params in dashboard_queries(bucket, top_k_arg(request.args, 3)):
+            rows, _, hit = run_query(name, sql, params)
+            data[section] = label_buckets(rows)
+            cached = cached and hit
+
+        res.update({
+            'code': 1,
+            'msg': 'ok',
+            'sqltime': round(time.time() - t0, 4),
+            'cached': cached,
+            'data': data
+        })
+
+    except Exception as e:
+        res.update({'code': 0, 'msg': f'Error: {str(e)}'})
+
+    return json_response(res)
+
+
+@app.route('/cacheStats')
+def cache_stats():
+    key = request.args.get('key')
+    res = {'req': 'cacheStats'}
+
+    if key != '123':
+        res['code'] = 0
+        res['msg'] = 'Invalid key'
+        return json_response(res)
+
+    res.update({
+        'code': 1,
+        'msg': 'ok',
+        'data': {**cache.stats(), 'data_version': data_version,
+                 'connections_opened': pool.opened if pool else 0,
+                 'backend': 'memory' if memory is not None else 'sql'}
+    })
+    return json_response(res)
+
 if __name__ == '__main__':
+    init_pool()
     app.run(debug=True)
@@ -0,0 +1,137 @@
+import asyncio
+import datetime as dt
+import socket
+import sqlite3
+import threading
+
+import pytest
+
+pytest.importorskip('quart')
+pytest.importorskip('aiomysql')
+mysql_mimic = pytest.importorskip('mysql_mimic')
+
+import async_app
+import test5
+
+# Smoke test of async_app.py's aiomysql query path and the /dashboardData
+# fan-out: a MySQL protocol server (mysql-mimic) answers test5.py's SQL
+# from a small SQLite complaint_rollup, and the async app must return the
+# same data as the sync one.
+
+boroughs = ['MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND']
+types = ['Noise - Residential', 'HEAT/HOT WATER', 'Illegal Parking', 'Blocked Driveway', 'DOF Property',
+         'Damaged Tree']
+
+urls = [
+    '/getHourlyComplaints?key=123',
+    '/getHourlyComplaints?key=123&format=columnar',
+    '/complaintsByTempBucket?key=123',
+    '/topComplaintTypesByTemp?key=123&k=3',
+    '/boroughComplaintsByTemp?key=123',
+    '/dashboardData?key=123&bucket=night&k=2',
+    '/getHourlyComplaints?key=bad',
+]
+
+
+def rollup_db():
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    db.execute("CREATE TABLE complaint_rollup (date, hour, borough, complaint_type, temperature_C, cnt)")
+    db.execute("CREATE TABLE data_version (name, version, changed_since, updated_at)")
+    rows = []
+    for d in range(20):
+        day = (dt.date(2015, 3, 1) + dt.timedelta(days=d)).isoformat()
+        for hour in range(0, 24, 3):
+            for i, borough in enumerate(boroughs):
+                for j, name in enumerate(types):
+                    if (d + hour + i + j) % 3:
+                        rows.append((day, hour, borough, name, (d * 7 + hour) % 35 - 5.5, (d + i * j) % 4 + 1))
+    db.executemany("INSERT INTO complaint_rollup VALUES (?, ?, ?, ?, ?, ?)", rows)
+    db.execute("INSERT INTO data_version VALUES ('nyc_complaints', 3, NULL, '2015-03-21 06:00:00')")
+    return db
+
+
+class SqliteSession(mysql_mimic.Session):
+    db = None
+
+    async def query(self, expression, sql, attrs):
+        sql = sql.replace("CAST(SUM(cnt) AS UNSIGNED)", "SUM(cnt)").replace(" COLLATE utf8mb4_bin", "")
+        cur = self.db.execute(sql)
+        names = [d[0] for d in cur.description]
+        rows = [[dt.datetime.fromisoformat(v) if n == 'updated_at' and v else v for n, v in zip(names, row)]
+                for row in cur.fetchall()]
+        return rows, names
+
+
+def close_idle(pool):
+    # test5's pool keeps its idle pymysql connections open
+    while pool is not None and not pool._idle.empty():
+        pool._close(pool._idle.get_nowait()[0])
+
+
+@pytest.fixture(scope='module')
+def mysql_port():
+    SqliteSession.db = rollup_db()
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    loop = asyncio.new_event_loop()
+    server = mysql_mimic.MysqlServer(session_factory=SqliteSession)
+    loop.run_until_complete(server.start_server(host='127.0.0.1', port=port))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield port
+    close_idle(test5.pool)
+    server.close()
+    asyncio.run_coroutine_threadsafe(server.wait_closed(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def comparable(body):
+    body = dict(body)
+    body.pop('sqltime', None)
+    body.pop('cached', None)
+    return body
+
+
+def test_async_matches_sync(mysql_port, tmp_path):
+    config = tmp_path / 'config.yaml'
+    config.write_text(f"db: {{host: 127.0.0.1, port: {mysql_port}, user: test, passwd: '', db: test}}\n")
+    async_app.app.config['CONFIG_FILE'] = str(config)
+
+    async def fetch():
+        # test_app runs before_serving: test5.init_pool and the aiomysql pool
+        async with async_app.app.test_app() as test_app:
+            client = test_app.test_client()
+            out = {}
+            for url in urls:
+                response = await client.get(url)
+                out[url] = response.status_code, await response.get_json()
+            stats = await (await client.get('/cacheStats?key=123')).get_json()
+            return out, stats
+
+    got, stats = asyncio.run(fetch())
+    assert stats['data']['backend'] == 'sql'
+    assert got['/dashboardData?key=123&bucket=night&k=2'][1]['code'] == 1
+
+    test5.cache.clear()
+    client = test5.app.test_client()
+    for url in urls:
+        response = client.get(url)
+        status, body = got[url]
+        assert status == response.status_code, url
+        assert comparable(body) == comparable(response.get_json()), url
+
+
+def test_data_version_of_configured_table(mysql_port, tmp_path):
+    # test4.py bumps data_version under tables.complaints
+    SqliteSession.db.execute("INSERT INTO data_version VALUES ('complaints_2015', 9, NULL, '2015-03-22 06:00:00')")
+    config = tmp_path / 'config.yaml'
+    config.write_text(f"db: {{host: 127.0.0.1, port: {mysql_port}, user: test, passwd: '', db: test}}\n"
+                      "tables: {complaints: complaints_2015}\n")
+    close_idle(test5.pool)
+    test5.init_pool(str(config))
+    test5._version_checked_at = 0
+    test5.check_data_version()
+    assert test5.data_version == 9
@@ -0,0 +1,74 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from memory_backend import MemoryBackend, PrefixCube
+
+# Incremental cube updates (replace_from) must give the same answers as
+# building the backend from scratch on the combined counts.
+
+boroughs = ['MANHATTAN', 'BROOKLYN', 'QUEENS', 'BRONX', 'STATEN ISLAND']
+types = ['Noise - Residential', 'HEAT/HOT WATER', 'Illegal Parking', 'Blocked Driveway']
+
+
+def counts(first, last, seed):
+    # (date str, hour, borough, complaint_type, temperature or None, count)
+    rng = random.Random(seed)
+    rows = []
+    day = date.fromisoformat(first)
+    while day <= date.fromisoformat(last):
+        for hour in range(0, 24, 5):
+            temp = rng.choice([None, round(rng.uniform(-5, 30), 1)])
+            for borough in boroughs:
+                for name in rng.sample(types, 2):
+                    rows.append((day.isoformat(), hour, borough, name, temp, rng.randint(1, 9)))
+        day += timedelta(days=1)
+    return rows
+
+
+queries = [
+    ('date_range', ('2015-01-01', '2015-03-31')),
+    ('date_range', ('2015-02-10', '2015-02-24')),
+    ('date_range', ('2015-02-20', '2015-03-05')),
+    ('date_hour', ('2015-01-15', '2015-03-10', 22, 3)),
+    ('hourly', ()),
+    ('top_by_time', (0, 10, 2)),
+    ('top_by_temp', (3,)),
+    ('temp_range', ('QUEENS', '2015-01-01', '2015-03-31', 0, 23)),
+    ('temp_range', ('BRONX', '2015-02-01', '2015-03-01', 8, 17, 1)),
+]
+
+
+def assert_same(backend, expected):
+    for name, params in queries:
+        assert backend.query(name, params) == expected.query(name, params), (name, params)
+
+
+@pytest.mark.parametrize('type_cube', [False, True])
+def test_replace_from_after_date_gap(type_cube):
+    # data ends 2015-02-09 and the next load starts 2015-02-25
+    old, new = counts('2015-01-01', '2015-02-09', 1), counts('2015-02-25', '2015-03-10', 2)
+    backend = MemoryBackend.from_counts(old, type_cube)
+    backend.replace_from('2015-02-25', new)
+    assert_same(backend, MemoryBackend.from_counts(old + new, type_cube))
+
+
+@pytest.mark.parametrize('type_cube', [False, True])
+def test_replace_from_overlapping_days(type_cube):
+    old = counts('2015-01-01', '2015-02-20', 1)
+    new = counts('2015-02-10', '2015-03-10', 3)
+    backend = MemoryBackend.from_counts(old, type_cube)
+    backend.replace_from('2015-02-10', new)
+    kept = [row for row in old if row[0] < '2015-02-10']
+    assert_same(backend, MemoryBackend.from_counts(kept + new, type_cube))
+
+
+def test_gap_days_carry_last_prefix():
+    day, hour, group, weight = (np.array(v) for v in ([0, 1], [3, 3], [0, 0], [2.0, 5.0]))
+    cube = PrefixCube.build(day, hour, group, weight, 2, 1)
+    cube.update(6, np.array([6]), np.array([3]), np.array([0]), np.array([1.0]), 7)
+    assert cube.window(0, 6)[3, 0] == 8
+    assert cube.window(2, 5)[3, 0] == 0
+    assert cube.window(1, 6)[3, 0] == 6
@@ -0,0 +1,56 @@
+import csv
+import json
+import os
+from datetime import date, timedelta
+
+import merge_partitions
+from test3 import index_weather
+
+# After any rerun the partition directory must hold exactly the months in
+# the current input, whether or not blocks of the old input were reused.
+
+header = ["Unique Key", "Created Date", "Borough", "Complaint Type", "Descriptor", "Location Type"]
+
+
+def weather():
+    days = [date(2015, 3, 1) + timedelta(days=d) for d in range(61)]
+    return index_weather((day.isoformat(), "10", "QUEENS", "11373", "12.5") for day in days)
+
+
+def write_complaints(path, days):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i, day in enumerate(days):
+            writer.writerow([i, day.strftime("%m/%d/%Y 10:15:00 AM"), "QUEENS", "Noise", "Loud Music", "Street"])
+
+
+def on_disk(out_dir):
+    with open(os.path.join(out_dir, merge_partitions.manifest_name)) as f:
+        listed = sorted(json.load(f)["partitions"])
+    files = sorted(name[:-4] for name in os.listdir(out_dir) if name.endswith(".csv"))
+    return listed, files
+
+
+def test_months_gone_from_a_rewritten_input_are_removed(tmp_path):
+    path, out_dir = str(tmp_path / "complaints.csv"), str(tmp_path / "partitions")
+    write_complaints(path, [date(2015, 3, 5), date(2015, 3, 20), date(2015, 4, 2)])
+    merge_partitions.run(path, weather(), out_dir)
+    assert on_disk(out_dir) == (["2015-03", "2015-04"], ["2015-03", "2015-04"])
+
+    # rewritten in place, so no block is kept
+    write_complaints(path, [date(2015, 4, 9), date(2015, 4, 30)])
+    manifest = merge_partitions.run(path, weather(), out_dir)
+    assert on_disk(out_dir) == (["2015-04"], ["2015-04"])
+    assert manifest["partitions"]["2015-04"]["merged"] == 2
+
+
+def test_appended_rows_keep_old_partitions(tmp_path):
+    path, out_dir = str(tmp_path / "complaints.csv"), str(tmp_path / "partitions")
+    days = [date(2015, 3, 5), date(2015, 3, 20)]
+    write_complaints(path, days)
+    merge_partitions.run(path, weather(), out_dir)
+    write_complaints(path, days + [date(2015, 4, 2)])
+    manifest = merge_partitions.run(path, weather(), out_dir)
+    assert on_disk(out_dir) == (["2015-03", "2015-04"], ["2015-03", "2015-04"])
+    assert [manifest["partitions"][m]["merged"] for m in ["2015-03", "2015-04"]] == [2, 1]
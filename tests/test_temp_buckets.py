@@ -0,0 +1,29 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from temp_buckets import TempBuckets
+
+# The temperature routes' labels and boundaries are part of the JSON API:
+# they must stay those of the original CASE, and SQL and NumPy must agree.
+
+temps = [-10, -0.1, 0, 5, 9.9, 10, 10.1, 19.9, 20, 20.1, 35]
+
+
+def test_default_buckets_match_original_case():
+    buckets = TempBuckets()
+    assert buckets.labels == ['< 0°C', '0-10°C', '10-20°C', '> 20°C']
+    # WHEN t < 0 / BETWEEN 0 AND 10 / BETWEEN 10 AND 20 / ELSE
+    want = [0 if t < 0 else 1 if t <= 10 else 2 if t <= 20 else 3 for t in temps]
+    assert buckets.digitize(np.array(temps, dtype=np.float32)).tolist() == want
+
+
+@pytest.mark.parametrize('edges', [(0, 10, 20), (5,), (-3.5, 2, 15, 30)])
+def test_sql_case_matches_digitize(edges):
+    buckets = TempBuckets(edges)
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE t (temperature_C REAL)")
+    db.executemany("INSERT INTO t VALUES (?)", [(t,) for t in temps])
+    sql = [b for (b,) in db.execute(f"SELECT {buckets.sql_case()} FROM t ORDER BY rowid")]
+    assert buckets.digitize(np.array(temps + [np.nan])).tolist() == sql + [-1]
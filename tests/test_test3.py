@@ -0,0 +1,97 @@
+import csv
+import io
+import random
+
+import pytest
+
+import test3
+
+# test3.py projects the 311 export without csv-parsing every line; the
+# result must match csv.reader over the whole file.
+
+header = ["Unique Key", "Created Date", "Agency", "Complaint Type", "Descriptor", "Location Type", "Borough",
+          "Resolution Description"]
+fields = ["plain", "with, comma", 'say "hi"', "two\nlines", 'a "quoted"\nbreak, too', "", '""', "\r\nstart"]
+
+
+def records(seed, n=300):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        row = [str(i), "07/01/2015 10:%02d:00 AM" % (i % 60)] + [rng.choice(fields) for _ in header[2:]]
+        if i % 37 == 5:
+            row = row[:rng.randint(1, 6)]
+        rows.append(row)
+    return rows
+
+
+def csv_text(rows, lineterminator):
+    out = io.StringIO(newline="")
+    writer = csv.writer(out, lineterminator=lineterminator)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def expected(text, columns):
+    positions = [header.index(c) for c in columns]
+    rows = list(csv.reader(io.StringIO(text, newline="")))[1:]
+    return [tuple(row[i] for i in positions) if len(row) > max(positions) else None for row in rows if row]
+
+
+@pytest.mark.parametrize("lineterminator", ["\r\n", "\n"])
+@pytest.mark.parametrize("columns", [test3.complaint_columns, ["Created Date", "Borough", "Resolution Description"],
+                                     ["Complaint Type"]])
+def test_project_columns_quoted_multiline(lineterminator, columns):
+    text = csv_text(records(1), lineterminator)
+    lines = io.StringIO(text, newline="").readlines()
+    assert list(test3.project_columns(lines[1:], header, columns)) == expected(text, columns)
+
+
+def test_read_complaints_skips_blank_lines():
+    text = csv_text(records(2, 40), "\r\n")
+    lines = io.StringIO(text, newline="").readlines()
+    lines[1:1] = ["\r\n", "\n"]
+    assert list(test3.read_complaints(lines)) == expected(text, test3.complaint_columns)
+
+
+@pytest.mark.parametrize("field", ["Complaint Type", "Resolution Description"])
+def test_truncated_quoted_record_is_rejected(field):
+    # the export ends inside a quoted field, in a projected or a trailing column
+    rows = records(4, 20)
+    last = ["99", "07/01/2015 10:00:00 AM"] + ["plain"] * (len(header) - 2)
+    last[header.index(field)] = "never\nclosed"
+    text = csv_text(rows + [last], "\r\n")
+    truncated = text[:text.rindex("never") + len("never\r\ncl")]
+    lines = io.StringIO(truncated, newline="").readlines()
+    got = list(test3.read_complaints(lines))
+    assert got == expected(csv_text(rows, "\r\n"), test3.complaint_columns) + [None]
+
+    weather = test3.index_weather([("2015-07-01", "10", "QUEENS", "11373", "20.0")])
+    stats = {"merged": 0, "skipped": 0}
+    list(test3.merge_complaints(got[-1:], weather, stats))
+    assert stats["rejects"] == {"missing column": 1}
+
+
+@pytest.mark.parametrize("block", [7, 64, test3.CHUNK_SCAN_BLOCK])
+def test_chunk_ranges_cut_on_record_boundaries(tmp_path, monkeypatch, block):
+    # most fields hold quoted newlines, so evenly spaced targets keep landing
+    # inside quotes; small scan blocks also split quotes and "\r\n" pairs
+    monkeypatch.setattr(test3, "CHUNK_SCAN_BLOCK", block)
+    path = tmp_path / "complaints.csv"
+    text = csv_text(records(3), "\r\n")
+    path.write_bytes(text.encode("utf-8"))
+    data = path.read_bytes()
+    header_end = data.index(b"\r\n") + 2
+    want = expected(text, test3.complaint_columns)
+    for n_chunks in [1, 2, 3, 7, 16, 50, 1000]:
+        ranges = test3.chunk_ranges(str(path), n_chunks)
+        assert ranges[0][0] == header_end and ranges[-1][1] == len(data)
+        assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+        assert len(ranges) <= n_chunks
+        got = []
+        for start, end in ranges:
+            assert data[:start].count(b'"') % 2 == 0
+            got += test3.project_columns(test3.iter_range_lines(str(path), start, end), header,
+                                         test3.complaint_columns)
+        assert got == want, n_chunks
@@ -0,0 +1,177 @@
+import csv
+import itertools
+import json
+import re
+import sqlite3
+from collections import Counter
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+import test4
+from merged_store import read_merged
+
+# Re-running test4.py's incremental load on the same input must leave the
+# table as it was, and a changed input must leave exactly the new rows.
+# The load runs against SQLite through a pymysql-shaped connection that
+# rewrites the few MySQL-only statements test4.py issues (mysql-mimic can't
+# report affected rows, which the stale-row delete depends on).
+
+sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+
+
+def mysql_to_sqlite(sql):
+    sql = sql.replace("%s", "?").replace("NOW()", "CURRENT_TIMESTAMP")
+    head, dup, update = sql.partition(" ON DUPLICATE KEY UPDATE ")
+    if dup:
+        update = re.sub(r"VALUES[(](\w+)[)]", r"excluded.\1", update)
+        sql = f"{head} ON CONFLICT (row_key) DO UPDATE SET {update}"
+    alter = re.fullmatch(r"ALTER TABLE (\w+) ADD COLUMN (.+), ADD UNIQUE INDEX (\w+) [(](\w+)[)]", sql)
+    if alter:
+        table, column, index, key = alter.groups()
+        return [f"ALTER TABLE {table} ADD COLUMN {column}", f"CREATE UNIQUE INDEX {index} ON {table} ({key})"]
+    return [sql]
+
+
+class Cursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, args=()):
+        if "information_schema.COLUMNS" in sql:
+            wanted = re.findall(r"'(\w+)'", sql)
+            self.rows = [(c[1],) for c in self.db.execute(f"PRAGMA table_info({args[0]})") if c[1] in wanted]
+            return
+        for statement in mysql_to_sqlite(sql):
+            cur = self.db.execute(statement, args)
+        self.rows, self.rowcount = cur.fetchall(), cur.rowcount
+
+    def executemany(self, sql, batch):
+        (statement,) = mysql_to_sqlite(sql)
+        self.rowcount = self.db.executemany(statement, batch).rowcount
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:", isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
+
+    def cursor(self):
+        return Cursor(self.db)
+
+    def begin(self):
+        self.db.execute("BEGIN")
+
+    def commit(self):
+        self.db.execute("COMMIT")
+
+    def rollback(self):
+        self.db.execute("ROLLBACK")
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    # load ids are whole seconds; give every load its own
+    clock = itertools.count(1_430_000_000)
+    monkeypatch.setattr(test4, "time", SimpleNamespace(time=lambda: next(clock)))
+    conn = Connection()
+    conn.db.execute("""CREATE TABLE nyc_complaints (
+        id INTEGER PRIMARY KEY, date VARCHAR(10) NOT NULL, hour TINYINT NOT NULL, borough VARCHAR(16) NOT NULL,
+        temperature_C FLOAT NULL, complaint_type VARCHAR(100) NOT NULL, descriptor VARCHAR(255) NOT NULL,
+        location_type VARCHAR(100) NOT NULL)""")
+    return conn
+
+
+def rows_for(days, seed=0):
+    rows = []
+    for d, day in enumerate(days):
+        for hour in range(0, 24, 6):
+            temp = None if (d + hour) % 5 == 0 else (d * 3 + hour) / 2 - 4
+            for borough in ["QUEENS", "BRONX"]:
+                rows.append((day, hour, borough, temp, "Noise", "Loud Music/Party", "Residential Building"))
+                # an identical complaint in the same hour
+                if (d + hour + seed) % 3 == 0:
+                    rows.append((day, hour, borough, temp, "Noise", "Loud Music/Party", "Residential Building"))
+                rows.append((day, hour, borough, temp, "HEAT/HOT WATER", "ENTIRE BUILDING", "RESIDENTIAL"))
+    return rows
+
+
+def write_merged(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(test4.columns)
+        writer.writerows(("" if v is None else v for v in row) for row in rows)
+
+
+def table_rows(conn):
+    return Counter(conn.db.execute(f"SELECT {', '.join(test4.columns)} FROM nyc_complaints"))
+
+
+def test_rerun_single_file(conn, tmp_path):
+    path = tmp_path / "merged.csv"
+    rows = rows_for(["2015-03-01", "2015-03-02", "2015-03-03"])
+    write_merged(path, rows)
+    assert test4.incremental_load(conn, "nyc_complaints", str(path))[:2] == (len(rows), 0)
+    assert table_rows(conn) == Counter(read_merged(str(path)))
+
+    # only the high-water day is loaded again, in place
+    last_day = sum(row[0] == "2015-03-03" for row in rows)
+    assert test4.incremental_load(conn, "nyc_complaints", str(path))[:2] == (last_day, 0)
+    assert table_rows(conn) == Counter(read_merged(str(path)))
+
+    # the last day gets a new temperature and loses a complaint; a new day follows
+    changed = [row[:3] + (21.5,) + row[4:] if row[0] == "2015-03-03" else row for row in rows]
+    changed.remove(("2015-03-03", 0, "QUEENS", 21.5, "Noise", "Loud Music/Party", "Residential Building"))
+    changed += rows_for(["2015-03-04"], seed=1)
+    write_merged(path, changed)
+    upserted, removed, spans = test4.incremental_load(conn, "nyc_complaints", str(path))
+    assert (upserted, removed, spans) == (sum(row[0] >= "2015-03-03" for row in changed), 1, [("2015-03-03", None)])
+    assert table_rows(conn) == Counter(read_merged(str(path)))
+    assert test4.load_state(conn, "nyc_complaints")["*"][1] == date(2015, 3, 4)
+
+
+def write_partitions(out_dir, months):
+    out_dir.mkdir(exist_ok=True)
+    for month, rows in months.items():
+        write_merged(out_dir / f"{month}.csv", rows)
+    with open(out_dir / "manifest.json", "w") as f:
+        json.dump({"partitions": {month: {"file": f"{month}.csv"} for month in months}}, f)
+
+
+def test_rerun_partitions(conn, tmp_path):
+    out_dir = tmp_path / "partitions"
+    months = {"2015-03": rows_for(["2015-03-30", "2015-03-31"]), "2015-04": rows_for(["2015-04-01", "2015-04-02"])}
+    write_partitions(out_dir, months)
+    test4.incremental_load(conn, "nyc_complaints", str(out_dir))
+    assert table_rows(conn) == Counter(read_merged(str(out_dir)))
+
+    # unchanged partitions are skipped by checksum
+    assert test4.incremental_load(conn, "nyc_complaints", str(out_dir)) == (0, 0, [])
+    assert table_rows(conn) == Counter(read_merged(str(out_dir)))
+
+    # April changes its duplicate counts and loses a day
+    months["2015-04"] = rows_for(["2015-04-01"], seed=1)
+    write_partitions(out_dir, months)
+    upserted, removed, spans = test4.incremental_load(conn, "nyc_complaints", str(out_dir))
+    assert spans == [("2015-04-01", "2015-05-01")]
+    assert table_rows(conn) == Counter(read_merged(str(out_dir)))
+
+    # a month that drops out of the manifest is deleted
+    (out_dir / "2015-03.csv").unlink()
+    write_partitions(out_dir, {"2015-04": months["2015-04"]})
+    upserted, removed, spans = test4.incremental_load(conn, "nyc_complaints", str(out_dir))
+    assert (upserted, removed) == (0, len(months["2015-03"]))
+    assert table_rows(conn) == Counter(read_merged(str(out_dir)))
+    assert set(test4.load_state(conn, "nyc_complaints")) == {"2015-04"}
+
+    # and is not selected again on the next run
+    assert test4.incremental_load(conn, "nyc_complaints", str(out_dir)) == (0, 0, [])
+    assert table_rows(conn) == Counter(read_merged(str(out_dir)))
@@ -0,0 +1,50 @@
+import pickle
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from weather_index import BOROUGH_IDS, BOROUGHS, WeatherIndex
+
+# The array index must answer like the dict test3.py used to build: a cell
+# with a blank temperature_C still merges (as ""), only missing cells skip.
+
+
+def weather_rows(seed):
+    rng = random.Random(seed)
+    rows = []
+    for d in range(10):
+        day = (date(2015, 7, 1) + timedelta(days=d)).isoformat()
+        for hour in range(24):
+            for borough in BOROUGHS:
+                roll = rng.random()
+                if roll < 0.2:
+                    continue
+                temp = "" if roll < 0.4 else str(round(rng.uniform(-5, 35), 1))
+                rows.append((day, str(hour), borough.title(), "10001", temp))
+    return rows
+
+
+def baseline_dict(rows):
+    return {(row[0], row[1], row[2].strip().upper()): row[4] for row in rows}
+
+
+@pytest.mark.parametrize("roundtrip", ["none", "npz", "pickle"])
+def test_lookup_matches_dict(tmp_path, roundtrip):
+    rows = weather_rows(1)
+    index = WeatherIndex.from_rows(rows)
+    if roundtrip == "npz":
+        index.save(str(tmp_path / "weather_index.npz"))
+        index = WeatherIndex.load(str(tmp_path / "weather_index.npz"))
+    elif roundtrip == "pickle":
+        index = pickle.loads(pickle.dumps(index))
+    expected = baseline_dict(rows)
+    base = date.fromordinal(index.base_ordinal)
+    for day in range(index.days):
+        day_str = (base + timedelta(days=day)).isoformat()
+        for hour in range(24):
+            for borough in BOROUGHS:
+                want = expected.get((day_str, str(hour), borough))
+                got = index.lookup(day, hour, BOROUGH_IDS[borough])
+                assert (got if got is None or got == "" else float(got)) == (
+                    want if want is None or want == "" else float(want)), (day_str, hour, borough)
@@ -0,0 +1,126 @@
+import csv
+import argparse
+from datetime import date, datetime
+
+import numpy as np
+
+BOROUGHS = ["MANHATTAN", "BROOKLYN", "QUEENS", "BRONX", "STATEN ISLAND"]
+BOROUGH_IDS = {b: i for i, b in enumerate(BOROUGHS)}
+HOUR_STRS = [str(h) for h in range(24)]
+
+weather_file = "nyc_weather_cleaned.csv"
+index_file = "weather_index.npz"
+
+
+class WeatherIndex:
+    # Hourly temperatures as a dense float32 array addressed by
+    # (day offset from base_date, hour, borough id). present marks the cells
+    # the cleaned CSV has a row for: a present NaN is a blank reading, which
+    # merges with an empty temperature_C like the dict lookup it replaced.
+    def __init__(self, base_ordinal, temps, present=None):
+        self.base_ordinal = int(base_ordinal)
+        self.temps = temps
+        # indexes saved before the mask had no blank cells
+        self.present = ~np.isnan(temps) if present is None else present
+        self.days = temps.shape[0]
+        self.date_strs = [date.fromordinal(self.base_ordinal + d).strftime("%Y-%m-%d") for d in range(self.days)]
+        self._text = {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        # rows are cleaned weather rows: (date, hour, borough, zipcode, temperature_C)
+        ordinals = {}
+        cells = []
+        for row in rows:
+            borough = BOROUGH_IDS.get(row[2].strip().upper())
+            if borough is None:
+                continue
+            day = ordinals.get(row[0])
+            if day is None:
+                try:
+                    day = datetime.strptime(row[0], "%Y-%m-%d").toordinal()
+                except ValueError:
+                    day = -1
+                ordinals[row[0]] = day
+            if day < 0:
+                continue
+            try:
+                hour = int(row[1])
+                temp = float(row[4]) if row[4] != "" else np.nan
+            except ValueError:
+                continue
+            if 0 <= hour < 24:
+                cells.append((day, hour, borough, temp))
+
+        if not cells:
+            return cls(date.today().toordinal(), np.full((0, 24, len(BOROUGHS)), np.nan, dtype=np.float32))
+        arr = np.array(cells, dtype=np.float64)
+        base = int(arr[:, 0].min())
+        shape = (int(arr[:, 0].max()) - base + 1, 24, len(BOROUGHS))
+        temps = np.full(shape, np.nan, dtype=np.float32)
+        present = np.zeros(shape, dtype=bool)
+        cell = (arr[:, 0].astype(np.int64) - base, arr[:, 1].astype(np.int64), arr[:, 2].astype(np.int64))
+        temps[cell] = arr[:, 3]
+        present[cell] = True
+        return cls(base, temps, present)
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, "r") as wf:
+            reader = csv.DictReader(wf)
+            return cls.from_rows(
+                (row["date"], row["hour"], row["borough"], row["zipcode"], row["temperature_C"]) for row in reader
+            )
+
+    @classmethod
+    def load(cls, path=index_file):
+        with np.load(path) as data:
+            return cls(data["base_ordinal"], data["temps"], data["present"] if "present" in data.files else None)
+
+    def save(self, path=index_file):
+        np.savez(path, base_ordinal=np.int64(self.base_ordinal), temps=self.temps, present=self.present)
+
+    def day_offset(self, ordinal):
+        day = ordinal - self.base_ordinal
+        return day if 0 <= day < self.days else -1
+
+    def lookup(self, day, hour, borough):
+        # Temperature as text for the merged CSV ("" for a blank reading), or
+        # None if the weather has no row for the cell
+        temp = self.temps[day, hour, borough]
+        if temp != temp:
+            return "" if self.present[day, hour, borough] else None
+        if temp == 0:
+            # 0.0 and -0.0 hash alike; keep their own text
+            return str(temp)
+        text = self._text.get(temp)
+        if text is None:
+            text = self._text[temp] = str(temp)
+        return text
+
+    def __getstate__(self):
+        return {"base_ordinal": self.base_ordinal, "temps": self.temps, "present": self.present}
+
+    def __setstate__(self, state):
+        self.__init__(state["base_ordinal"], state["temps"], state.get("present"))
+
+
+def load_index(path):
+    # Accepts either a saved .npz index or a cleaned weather CSV
+    if path.endswith(".npz"):
+        return WeatherIndex.load(path)
+    return WeatherIndex.from_csv(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the array-backed weather index from the cleaned CSV")
+    parser.add_argument("--weather", default=weather_file)
+    parser.add_argument("--output", default=index_file)
+    args = parser.parse_args()
+
+    index = WeatherIndex.from_csv(args.weather)
+    index.save(args.output)
+    filled = int(np.count_nonzero(~np.isnan(index.temps)))
+    blank = int(np.count_nonzero(index.present)) - filled
+    print(f"Indexed {filled} readings ({blank} blank) over {index.days} days starting {index.date_strs[0] if index.days else '-'}")
+    print(f"Saved to {args.output}")